@@ -3,9 +3,18 @@ Define classes for accessing data sources in a generic fashion (and may not be
 connected directly but indirectly through a web service, for example).
 """
 
+import collections
 import cx_Exceptions
+import cx_Threads
+import sys
+import threading
+import time
 
 class DataSource(object):
+    arraySize = 500
+    threadSafe = False
+    supportsOrderBy = False
+    resultCache = None
 
     def BeginTransaction(self):
         return Transaction()
@@ -19,7 +28,8 @@ class DataSource(object):
     def CommitTransaction(self, transaction):
         raise NotImplementedError
 
-    def GetSqlAndArgs(self, tableName, columnNames, **conditions):
+    def GetSqlAndArgs(self, tableName, columnNames, _orderBy = None,
+            _limit = None, _offset = None, _after = None, **conditions):
         raise NotImplementedError
 
     def GetWhereClauseAndArgs(self, **conditions):
@@ -36,19 +46,67 @@ class DataSource(object):
         return rows[0]
 
     def GetRows(self, _tableName, _columnNames, _rowFactory = None,
+            _orderBy = None, _limit = None, _offset = None, _after = None,
             **_conditions):
+        if _orderBy is not None or _limit is not None \
+                or _offset is not None or _after is not None:
+            _conditions.update(_orderBy = _orderBy, _limit = _limit,
+                    _offset = _offset, _after = _after)
         sql, args = self.GetSqlAndArgs(_tableName, _columnNames, **_conditions)
-        return self.GetRowsDirect(sql, args, _rowFactory)
+        cache = self.resultCache
+        if cache is None or not cache.IsCached(_tableName):
+            return self.GetRowsDirect(sql, args, _rowFactory)
+        key = (sql, repr(args), _rowFactory)
+        rows = cache.Get(key, _tableName)
+        if rows is None:
+            rows = self.GetRowsDirect(sql, args, _rowFactory)
+            cache.Set(key, _tableName, rows)
+        return list(rows)
+
+    def InvalidateResultCache(self, transaction):
+        """Remove the results cached for the tables modified by the items in
+           the transaction; all results are removed if the transaction calls
+           any procedures since their effects are unknown."""
+        cache = self.resultCache
+        if cache is not None:
+            for item in transaction.items:
+                if item.tableName is None:
+                    cache.Clear()
+                    break
+                cache.InvalidateTable(item.tableName)
+
+    def SetResultCache(self, cache):
+        """Set the cache used for the results of GetRows(), or None to stop
+           caching results."""
+        self.resultCache = cache
 
     def GetRowsDirect(self, sql, args, rowFactory = None):
         raise NotImplementedError
 
+    def IterRows(self, _tableName, _columnNames, _rowFactory = None,
+            _arraySize = None, _orderBy = None, _limit = None, _offset = None,
+            _after = None, **_conditions):
+        if _orderBy is not None or _limit is not None \
+                or _offset is not None or _after is not None:
+            _conditions.update(_orderBy = _orderBy, _limit = _limit,
+                    _offset = _offset, _after = _after)
+        sql, args = self.GetSqlAndArgs(_tableName, _columnNames, **_conditions)
+        return self.IterRowsDirect(sql, args, _rowFactory, _arraySize)
+
+    def IterRowsDirect(self, sql, args, rowFactory = None, arraySize = None):
+        return iter(self.GetRowsDirect(sql, args, rowFactory))
+
 
 class DatabaseDataSource(DataSource):
+    supportsOrderBy = True
+    sequenceBlockSize = 1
+    statementCacheSize = 1000
+    maxInListSize = 1000
 
     def __init__(self, connection):
         self.connection = connection
         self.cursor = connection.cursor()
+        self._Initialize()
 
     def __enter__(self):
         return self.cursor
@@ -59,23 +117,150 @@ class DatabaseDataSource(DataSource):
         else:
             self.connection.rollback()
 
+    def _AddKeysetClause(self, orderBy, whereClauses, args):
+        keysetClauses = []
+        for i, name in enumerate(orderBy):
+            clauses = []
+            for j, priorName in enumerate(orderBy[:i]):
+                self._AddWhereClauseAndArg(priorName.lstrip("-"), "eq",
+                        BindMarker("_after", j), clauses, args)
+            rawOperator = "lt" if name.startswith("-") else "gt"
+            self._AddWhereClauseAndArg(name.lstrip("-"), rawOperator,
+                    BindMarker("_after", i), clauses, args)
+            keysetClauses.append("(%s)" % " and ".join(clauses))
+        whereClauses.append("(%s)" % " or ".join(keysetClauses))
+
+    def _AddLimitClause(self, sql, hasLimit, hasOffset, args):
+        raise NotImplementedError
+
     def _AddWhereClauseAndArg(self, columnName, rawOperator, value,
             whereClauses, args):
         raise NotImplementedError
 
+    def _AddWhereClauses(self, shape, whereClauses, args):
+        for name, size in shape:
+            pos = name.find("__")
+            if pos < 0:
+                columnName = name
+                rawOperator = None
+            else:
+                columnName = name[:pos]
+                rawOperator = name[pos + 2:]
+            if size is None:
+                value = None
+            elif rawOperator == "in":
+                value = [BindMarker(name, i) for i in range(size)]
+            else:
+                value = BindMarker(name)
+            self._AddWhereClauseAndArg(columnName, rawOperator, value,
+                    whereClauses, args)
+
+    def _BuildInsertSql(self, tableName, insertNames):
+        raise NotImplementedError
+
+    def _BuildUpdateSql(self, tableName, setNames, conditionNames):
+        raise NotImplementedError
+
+    def _BuildSelectSql(self, tableName, columnNames, shape, orderBy,
+            hasLimit, hasOffset, hasAfter):
+        args = self._GetEmptyArgs()
+        whereClauses = []
+        self._AddWhereClauses(shape, whereClauses, args)
+        if hasAfter:
+            self._AddKeysetClause(orderBy, whereClauses, args)
+        sql = "select %s from %s" % (", ".join(columnNames), tableName)
+        if whereClauses:
+            sql += " where " + " and ".join(whereClauses)
+        if orderBy:
+            sql += " order by " + ", ".join(n[1:] + " desc" \
+                    if n.startswith("-") else n for n in orderBy)
+        if hasLimit or hasOffset:
+            sql = self._AddLimitClause(sql, hasLimit, hasOffset, args)
+        return sql, self._GetLayout(args)
+
+    def _BuildWhereClause(self, shape):
+        args = self._GetEmptyArgs()
+        whereClauses = []
+        self._AddWhereClauses(shape, whereClauses, args)
+        whereClause = " and ".join(whereClauses) if whereClauses else None
+        return whereClause, self._GetLayout(args)
+
+    def _ConvertInListValues(self, conditions):
+        """Convert the values of "in" conditions which are not sequences (such
+           as sets or generators) to lists so that they can be counted when
+           determining the shape and indexed when setting the arguments."""
+        for name, value in conditions.items():
+            if name.endswith("__in") and value is not None \
+                    and not isinstance(value, (list, tuple)):
+                conditions[name] = list(value)
+
     def _GetBlobType(self):
         raise NotImplementedError
 
+    def _Initialize(self):
+        self.sequenceLock = threading.Lock()
+        self.sequenceValues = {}
+        self.statementCache = StatementCache(self.statementCacheSize)
+
     def _GetClobType(self):
         raise NotImplementedError
 
     def _GetEmptyArgs(self):
         raise NotImplementedError
 
+    def _GetConditionsShape(self, conditions):
+        shape = []
+        for name, value in conditions.items():
+            if value is None:
+                size = None
+            elif name.endswith("__in"):
+                size = self._GetInListSize(len(value))
+            else:
+                size = 0
+            shape.append((name, size))
+        return tuple(shape)
+
+    def _GetLayout(self, args):
+        if isinstance(args, dict):
+            return [(n, m.name, m.index) for n, m in args.items()]
+        return [(None, m.name, m.index) for m in args]
+
+    def _GetInListSize(self, numValues):
+        if numValues == 0:
+            return 0
+        size = 1
+        while size < numValues:
+            size *= 2
+        return max(numValues, min(size, self.maxInListSize))
+
+    def _GetInsertSql(self, tableName, insertNames):
+        key = ("insert", tableName, tuple(insertNames))
+        sql = self.statementCache.Get(key)
+        if sql is None:
+            sql = self._BuildInsertSql(tableName, insertNames)
+            self.statementCache.Set(key, sql)
+        return sql
+
+    def _GetSequenceValuesSqlAndArgs(self, sequenceName, numValues):
+        raise NotImplementedError
+
+    def _TransactionAllocateKeys(self, cursor, transaction):
+        itemsBySequence = {}
+        for item in transaction.items:
+            if item.procedureName is None and item.conditions is None \
+                    and item.pkSequenceName is not None:
+                items = itemsBySequence.setdefault(item.pkSequenceName, [])
+                items.append(item)
+        for sequenceName, items in itemsBySequence.items():
+            values = self.GetSequenceValues(sequenceName, len(items), cursor)
+            for item, value in zip(items, values):
+                item.generatedKey = value
+
     def _TransactionCallProcedure(self, cursor, item):
-        args = self._TransactionSetupPositionalArgs(cursor, item.args,
+        args, inputSizes = self._TransactionGetPositionalArgs(item.args,
                 item.clobArgs, item.blobArgs, item.fkArgs,
                 item.referencedItems)
+        self._TransactionSetInputSizes(cursor, inputSizes)
         if item.returnType is not None:
             item.generatedKey = cursor.callfunc(item.procedureName,
                     item.returnType, args)
@@ -83,30 +268,37 @@ class DatabaseDataSource(DataSource):
             cursor.callproc(item.procedureName, args)
 
     def _TransactionDeleteRow(self, cursor, item):
+        sql, args, inputSizes = \
+                self._TransactionDeleteRowStatement(cursor, item)
+        self._TransactionExecute(cursor, sql, [args], inputSizes)
+
+    def _TransactionDeleteRowStatement(self, cursor, item):
         whereClause, args = self.GetWhereClauseAndArgs(**item.conditions)
         sql = "delete from %s" % item.tableName
         if whereClause is not None:
             sql += " where " + whereClause
-        cursor.execute(sql, args)
+        return sql, args, None
 
-    def _TransactionInsertRow(self, cursor, item):
-        raise NotImplementedError
+    def _TransactionExecute(self, cursor, sql, argsList, inputSizes):
+        self._TransactionSetInputSizes(cursor, inputSizes)
+        if len(argsList) == 1:
+            cursor.execute(sql, argsList[0])
+        else:
+            cursor.executemany(sql, argsList)
 
-    def _TransactionSetupKeywordArgs(self, cursor, args, clobArgs, blobArgs,
+    def _TransactionGetKeywordArgs(self, args, clobArgs, blobArgs,
             fkArgs = [], referencedItems = []):
         inputSizes = {}
         for attrName in clobArgs:
             inputSizes[attrName] = self._GetClobType()
         for attrName in blobArgs:
             inputSizes[attrName] = self._GetBlobType()
-        if inputSizes:
-            cursor.setinputsizes(**inputSizes)
         args = args.copy()
         for attrName, referencedItem in zip(fkArgs, referencedItems):
             args[attrName] = referencedItem.generatedKey
-        return args
+        return args, inputSizes
 
-    def _TransactionSetupPositionalArgs(self, cursor, args, clobArgs, blobArgs,
+    def _TransactionGetPositionalArgs(self, args, clobArgs, blobArgs,
             fkArgs = [], referencedItems = []):
         inputSizes = []
         for attrIndex in clobArgs:
@@ -117,12 +309,70 @@ class DatabaseDataSource(DataSource):
             while len(inputSizes) <= attrIndex:
                 inputSizes.append(None)
             inputSizes[attrIndex] = self._GetBlobType()
-        if inputSizes:
-            cursor.setinputsizes(*inputSizes)
         args = list(args)
         for attrIndex, referencedItem in zip(fkArgs, referencedItems):
             args[attrIndex] = referencedItem.generatedKey
-        return args
+        return args, inputSizes
+
+    def _TransactionGetStatement(self, cursor, item):
+        if item.setValues is not None and item.conditions is None:
+            return self._TransactionInsertRowStatement(cursor, item)
+        elif item.setValues is not None:
+            return self._TransactionUpdateRowStatement(cursor, item)
+        return self._TransactionDeleteRowStatement(cursor, item)
+
+    def _TransactionInsertRow(self, cursor, item):
+        sql, args, inputSizes = \
+                self._TransactionInsertRowStatement(cursor, item)
+        self._TransactionExecute(cursor, sql, [args], inputSizes)
+
+    def _TransactionInsertRowStatement(self, cursor, item):
+        raise NotImplementedError
+
+    def _TransactionIsBatchable(self, cursor, item):
+        return item.procedureName is None
+
+    def _TransactionProcessItem(self, cursor, item):
+        if item.procedureName is not None:
+            self._TransactionCallProcedure(cursor, item)
+        elif item.setValues is not None and item.conditions is None:
+            self._TransactionInsertRow(cursor, item)
+        elif item.setValues is not None:
+            self._TransactionUpdateRow(cursor, item)
+        else:
+            self._TransactionDeleteRow(cursor, item)
+
+    def _TransactionSetInputSizes(self, cursor, inputSizes):
+        if isinstance(inputSizes, dict):
+            cursor.setinputsizes(**inputSizes)
+        elif inputSizes:
+            cursor.setinputsizes(*inputSizes)
+
+    def _TransactionUpdateRow(self, cursor, item):
+        sql, args, inputSizes = \
+                self._TransactionUpdateRowStatement(cursor, item)
+        self._TransactionExecute(cursor, sql, [args], inputSizes)
+
+    def _TransactionUpdateRowStatement(self, cursor, item):
+        raise NotImplementedError
+
+    def _GetUpdateSql(self, tableName, setNames, conditionNames):
+        key = ("update", tableName, tuple(setNames), tuple(conditionNames))
+        sql = self.statementCache.Get(key)
+        if sql is None:
+            sql = self._BuildUpdateSql(tableName, setNames, conditionNames)
+            self.statementCache.Set(key, sql)
+        return sql
+
+    def _SetArgsFromLayout(self, layout, values, args):
+        for argName, name, index in layout:
+            value = values[name]
+            if index is not None:
+                value = value[min(index, len(value) - 1)]
+            if argName is None:
+                args.append(value)
+            else:
+                args[argName] = value
 
     def CallFunction(self, functionName, returnType, *args):
         return self.cursor.callfunc(functionName, returnType, args)
@@ -131,47 +381,113 @@ class DatabaseDataSource(DataSource):
         return self.cursor.callproc(procedureName, args)
 
     def CommitTransaction(self, transaction):
+        """Commit the transaction. Consecutive items which result in the same
+           statement (same table, operation and columns) are executed
+           together as a single array bind using executemany(); items are
+           otherwise processed in order so that generated keys are available
+           to the items that reference them."""
         try:
             cursor = self.connection.cursor()
+            self._TransactionAllocateKeys(cursor, transaction)
+            batchKey = batchSql = batchInputSizes = None
+            batchArgs = []
             for item in transaction.items:
-                if item.procedureName is not None:
-                    self._TransactionCallProcedure(cursor, item)
-                elif item.setValues is not None and item.conditions is None:
-                    self._TransactionInsertRow(cursor, item)
-                elif item.setValues is not None:
-                    self._TransactionUpdateRow(cursor, item)
+                statement = None
+                if self._TransactionIsBatchable(cursor, item):
+                    statement = self._TransactionGetStatement(cursor, item)
+                    sql, args, inputSizes = statement
+                    key = (sql, repr(inputSizes))
+                    if key == batchKey:
+                        batchArgs.append(args)
+                        continue
+                if batchArgs:
+                    self._TransactionExecute(cursor, batchSql, batchArgs,
+                            batchInputSizes)
+                    batchKey = None
+                    batchArgs = []
+                if statement is None:
+                    self._TransactionProcessItem(cursor, item)
                 else:
-                    self._TransactionDeleteRow(cursor, item)
+                    batchKey = key
+                    batchSql = sql
+                    batchArgs = [args]
+                    batchInputSizes = inputSizes
+            if batchArgs:
+                self._TransactionExecute(cursor, batchSql, batchArgs,
+                        batchInputSizes)
             self.connection.commit()
         except:
             self.connection.rollback()
             raise
+        self.InvalidateResultCache(transaction)
 
-    def GetSqlAndArgs(self, tableName, columnNames, **conditions):
-        sql = "select %s from %s" % (", ".join(columnNames), tableName)
-        if conditions:
-            whereClause, args = self.GetWhereClauseAndArgs(**conditions)
-            sql += " where " + whereClause
-        else:
-            args = self._GetEmptyArgs()
+    def GetSqlAndArgs(self, tableName, columnNames, _orderBy = None,
+            _limit = None, _offset = None, _after = None, **conditions):
+        """Return the select statement and arguments for the conditions. The
+           rows are ordered by the columns in _orderBy (names prefixed with
+           "-" are sorted in descending order); _limit and _offset restrict
+           the rows to a single page and _after, if specified, contains the
+           values of the _orderBy columns of the row after which the rows
+           are to start (keyset pagination)."""
+        if _after is not None and not _orderBy:
+            raise ValueError("_after requires _orderBy to be specified")
+        self._ConvertInListValues(conditions)
+        shape = self._GetConditionsShape(conditions)
+        orderBy = tuple(_orderBy or ())
+        hasLimit = _limit is not None
+        hasOffset = _offset is not None
+        hasAfter = _after is not None
+        key = ("select", tableName, tuple(columnNames), shape, orderBy,
+                hasLimit, hasOffset, hasAfter)
+        entry = self.statementCache.Get(key)
+        if entry is None:
+            entry = self._BuildSelectSql(tableName, columnNames, shape,
+                    orderBy, hasLimit, hasOffset, hasAfter)
+            self.statementCache.Set(key, entry)
+        sql, layout = entry
+        if hasLimit or hasOffset or hasAfter:
+            conditions = dict(conditions, _limit = _limit, _offset = _offset,
+                    _after = _after)
+        args = self._GetEmptyArgs()
+        self._SetArgsFromLayout(layout, conditions, args)
         return sql, args
 
+    def GetSequenceValues(self, sequenceName, numValues = 1, cursor = None):
+        """Return the requested number of values from the sequence. Values
+           are fetched from the database in blocks of at least
+           sequenceBlockSize in a single round trip; values not handed out
+           are retained for subsequent requests."""
+        with self.sequenceLock:
+            values = self.sequenceValues.setdefault(sequenceName, [])
+            if len(values) < numValues:
+                numToFetch = max(numValues - len(values),
+                        self.sequenceBlockSize)
+                sql, args = self._GetSequenceValuesSqlAndArgs(sequenceName,
+                        numToFetch)
+                if cursor is None:
+                    cursor = self.connection.cursor()
+                cursor.execute(sql, args)
+                values.extend(sorted(v for v, in cursor.fetchall()))
+            result = values[:numValues]
+            del values[:numValues]
+        return result
+
     def GetWhereClauseAndArgs(self, **conditions):
+        """Return the where clause and arguments for the conditions. The
+           clause is generated once for each shape of the conditions (names,
+           null values and the number of values in "in" lists, which are
+           padded to powers of two) and cached together with the layout of
+           the bind variables so that the same text is reused."""
+        self._ConvertInListValues(conditions)
+        shape = self._GetConditionsShape(conditions)
+        key = ("where", shape)
+        entry = self.statementCache.Get(key)
+        if entry is None:
+            entry = self._BuildWhereClause(shape)
+            self.statementCache.Set(key, entry)
+        whereClause, layout = entry
         args = self._GetEmptyArgs()
-        whereClause = None
-        if conditions:
-            whereClauses = []
-            for name, value in conditions.items():
-                pos = name.find("__")
-                if pos < 0:
-                    columnName = name
-                    rawOperator = None
-                else:
-                    columnName = name[:pos]
-                    rawOperator = name[pos + 2:]
-                self._AddWhereClauseAndArg(columnName, rawOperator, value,
-                        whereClauses, args)
-            whereClause = " and ".join(whereClauses)
+        self._SetArgsFromLayout(layout, conditions, args)
         return whereClause, args
 
     def GetRowsDirect(self, sql, args = None, rowFactory = None):
@@ -180,14 +496,39 @@ class DatabaseDataSource(DataSource):
             args = []
         cursor.execute(sql, args)
         if rowFactory is not None:
+            batchFactory = getattr(rowFactory, "FromTuples", None)
+            if batchFactory is not None:
+                return batchFactory(cursor.fetchall())
             cursor.rowfactory = rowFactory
         return cursor.fetchall()
 
+    def IterRowsDirect(self, sql, args = None, rowFactory = None,
+            arraySize = None):
+        cursor = self.connection.cursor()
+        cursor.arraysize = arraySize or self.arraySize
+        if args is None:
+            args = []
+        cursor.execute(sql, args)
+        batchFactory = None
+        if rowFactory is not None:
+            batchFactory = getattr(rowFactory, "FromTuples", None)
+            if batchFactory is None:
+                cursor.rowfactory = rowFactory
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            if batchFactory is not None:
+                rows = batchFactory(rows)
+            for row in rows:
+                yield row
+
 
 class OracleDataSource(DatabaseDataSource):
     operators = {
             "contains" : "like",
             "endswith" : "like",
+            "eq" : "=",
             "lt" : "<",
             "lte" : "<=",
             "ne" : "!=",
@@ -238,6 +579,26 @@ class OracleDataSource(DatabaseDataSource):
         args[argName] = value
         whereClauses.append(clauseFormat % (columnName, argName))
 
+    def _AddLimitClause(self, sql, hasLimit, hasOffset, args):
+        if hasOffset:
+            sql += " offset :row_offset rows"
+            args["row_offset"] = BindMarker("_offset")
+        if hasLimit:
+            sql += " fetch next :row_limit rows only"
+            args["row_limit"] = BindMarker("_limit")
+        return sql
+
+    def _BuildInsertSql(self, tableName, insertNames):
+        insertValues = [":%s" % n for n in insertNames]
+        return "insert into %s (%s) values (%s)" % \
+                (tableName, ",".join(insertNames), ",".join(insertValues))
+
+    def _BuildUpdateSql(self, tableName, setNames, conditionNames):
+        setClauses = ["%s = :%s" % (n, n) for n in setNames]
+        whereClauses = ["%s = :%s" % (n, n) for n in conditionNames]
+        return "update %s set %s where %s" % \
+                (tableName, ",".join(setClauses), " and ".join(whereClauses))
+
     def _GetBlobType(self):
         return self.connection.BLOB
 
@@ -247,34 +608,31 @@ class OracleDataSource(DatabaseDataSource):
     def _GetEmptyArgs(self):
         return {}
 
-    def _TransactionInsertRow(self, cursor, item):
-        if item.pkSequenceName is not None:
-            sql = "select %s.nextval from dual" % item.pkSequenceName
-            cursor.execute(sql)
-            item.generatedKey, = cursor.fetchone()
-        values = self._TransactionSetupKeywordArgs(cursor, item.setValues,
+    def _GetSequenceValuesSqlAndArgs(self, sequenceName, numValues):
+        sql = "select %s.nextval from dual connect by level <= :numValues" % \
+                sequenceName
+        return sql, dict(numValues = numValues)
+
+    def _TransactionInsertRowStatement(self, cursor, item):
+        if item.pkSequenceName is not None and item.generatedKey is None:
+            item.generatedKey, = \
+                    self.GetSequenceValues(item.pkSequenceName, 1, cursor)
+        values, inputSizes = self._TransactionGetKeywordArgs(item.setValues,
                 item.clobArgs, item.blobArgs, item.fkArgs,
                 item.referencedItems)
         if item.pkSequenceName is not None:
             values[item.pkAttrName] = item.generatedKey
-        insertNames = list(values.keys())
-        insertValues = [":%s" % n for n in insertNames]
-        sql = "insert into %s (%s) values (%s)" % \
-                (item.tableName, ",".join(insertNames), ",".join(insertValues))
-        cursor.execute(sql, values)
+        sql = self._GetInsertSql(item.tableName, list(values.keys()))
+        return sql, values, inputSizes
 
-    def _TransactionUpdateRow(self, cursor, item):
-        args = self._TransactionSetupKeywordArgs(cursor, item.setValues,
+    def _TransactionUpdateRowStatement(self, cursor, item):
+        args, inputSizes = self._TransactionGetKeywordArgs(item.setValues,
                 item.clobArgs, item.blobArgs)
         args.update(item.conditions)
         conditionNames = list(item.conditions.keys())
-        setClauses = ["%s = :%s" % (n, n) for n in args \
-                if n not in conditionNames]
-        whereClauses = ["%s = :%s" % (n, n) for n in conditionNames]
-        sql = "update %s set %s where %s" % \
-                (item.tableName, ",".join(setClauses),
-                        " and ".join(whereClauses))
-        cursor.execute(sql, args)
+        setNames = [n for n in args if n not in conditionNames]
+        sql = self._GetUpdateSql(item.tableName, setNames, conditionNames)
+        return sql, args, inputSizes
 
 
 class ODBCDataSource(DatabaseDataSource):
@@ -282,6 +640,7 @@ class ODBCDataSource(DatabaseDataSource):
             "contains" : "like",
             "icontains" : "ilike",
             "endswith" : "like",
+            "eq" : "=",
             "iendswith" : "ilike",
             "lt" : "<",
             "lte" : "<=",
@@ -292,6 +651,15 @@ class ODBCDataSource(DatabaseDataSource):
             "istartswith" : "ilike"
     }
 
+    def _AddLimitClause(self, sql, hasLimit, hasOffset, args):
+        if hasLimit:
+            sql += " limit ?"
+            args.append(BindMarker("_limit"))
+        if hasOffset:
+            sql += " offset ?"
+            args.append(BindMarker("_offset"))
+        return sql
+
     def _AddWhereClauseAndArg(self, columnName, rawOperator, value,
             whereClauses, args):
         if rawOperator is None:
@@ -307,6 +675,12 @@ class ODBCDataSource(DatabaseDataSource):
                 clauseFormat = "%s {0} ? || '%%'".format(operator)
             elif rawOperator in ("endswith", "iendswith"):
                 clauseFormat = "%s {0} '%%' || ?".format(operator)
+            elif rawOperator == "in":
+                inClauseParts = ["?" for v in value]
+                clause = "%s in (%s)" % (columnName, ",".join(inClauseParts))
+                whereClauses.append(clause)
+                args.extend(value)
+                return
             elif rawOperator == "ne" and value is None:
                 whereClauses.append("%s is not null" % columnName)
                 return
@@ -315,25 +689,26 @@ class ODBCDataSource(DatabaseDataSource):
         args.append(value)
         whereClauses.append(clauseFormat % columnName)
 
+    def _BuildInsertSql(self, tableName, insertNames):
+        insertValues = ["?" for n in insertNames]
+        return "insert into %s (%s) values (%s)" % \
+                (tableName, ",".join(insertNames), ",".join(insertValues))
+
+    def _BuildUpdateSql(self, tableName, setNames, conditionNames):
+        setClauses = ["%s = ?" % n for n in setNames]
+        whereClauses = ["%s = ?" % n for n in conditionNames]
+        return "update %s set %s where %s" % \
+                (tableName, ",".join(setClauses), " and ".join(whereClauses))
+
     def _GetEmptyArgs(self):
         return []
 
-    def _TransactionInsertRow(self, cursor, item):
-        if item.pkSequenceName is not None:
-            sql = "select nextval('%s')::integer" % item.pkSequenceName
-            cursor.execute(sql)
-            item.generatedKey, = cursor.fetchone()
-            item.setValues[item.pkAttrName] = item.generatedKey
-        insertNames = list(item.setValues.keys())
-        args = self._TransactionSetupArgs(cursor, item, insertNames)
-        insertValues = ["?" for n in insertNames]
-        sql = "insert into %s (%s) values (%s)" % \
-                (item.tableName, ",".join(insertNames), ",".join(insertValues))
-        cursor.execute(sql, args)
-        if hasattr(cursor, "lastrowid") and item.pkAttrName is not None:
-            item.generatedKey = cursor.lastrowid
+    def _GetSequenceValuesSqlAndArgs(self, sequenceName, numValues):
+        sql = "select nextval('%s')::integer from generate_series(1, ?)" % \
+                sequenceName
+        return sql, [numValues]
 
-    def _TransactionSetupArgs(self, cursor, item, setValueNames):
+    def _TransactionGetArgs(self, item, setValueNames):
         clobArgs = []
         blobArgs = []
         fkArgs = [None] * len(item.fkArgs)
@@ -346,21 +721,400 @@ class ODBCDataSource(DatabaseDataSource):
             elif name in item.fkArgs:
                 fkArgs[item.fkArgs.index(name)] = attrIndex
             args.append(item.setValues[name])
-        return self._TransactionSetupPositionalArgs(cursor, args, clobArgs,
-                blobArgs, fkArgs, item.referencedItems)
+        return self._TransactionGetPositionalArgs(args, clobArgs, blobArgs,
+                fkArgs, item.referencedItems)
 
-    def _TransactionUpdateRow(self, cursor, item):
+    def _TransactionInsertRow(self, cursor, item):
+        super(ODBCDataSource, self)._TransactionInsertRow(cursor, item)
+        if hasattr(cursor, "lastrowid") and item.pkAttrName is not None:
+            item.generatedKey = cursor.lastrowid
+
+    def _TransactionInsertRowStatement(self, cursor, item):
+        if item.pkSequenceName is not None:
+            if item.generatedKey is None:
+                item.generatedKey, = \
+                        self.GetSequenceValues(item.pkSequenceName, 1, cursor)
+            item.setValues[item.pkAttrName] = item.generatedKey
+        insertNames = list(item.setValues.keys())
+        args, inputSizes = self._TransactionGetArgs(item, insertNames)
+        sql = self._GetInsertSql(item.tableName, insertNames)
+        return sql, args, inputSizes
+
+    def _TransactionIsBatchable(self, cursor, item):
+        if item.setValues is not None and item.conditions is None \
+                and item.pkAttrName is not None \
+                and hasattr(cursor, "lastrowid"):
+            return False
+        return super(ODBCDataSource, self)._TransactionIsBatchable(cursor,
+                item)
+
+    def _TransactionUpdateRowStatement(self, cursor, item):
         setNames = list(item.setValues.keys())
         conditionNames = list(item.conditions.keys())
-        args = self._TransactionSetupArgs(cursor, item, setNames)
+        args, inputSizes = self._TransactionGetArgs(item, setNames)
         for name in conditionNames:
             args.append(item.conditions[name])
-        setClauses = ["%s = ?" % n for n in setNames]
-        whereClauses = ["%s = ?" % n for n in conditionNames]
-        sql = "update %s set %s where %s" % \
-                (item.tableName, ",".join(setClauses),
-                        " and ".join(whereClauses))
-        cursor.execute(sql, args)
+        sql = self._GetUpdateSql(item.tableName, setNames, conditionNames)
+        return sql, args, inputSizes
+
+
+class PooledDatabaseDataSource(DatabaseDataSource):
+    """Data source which borrows a connection from a pool for each call
+       instead of using a single connection, so that one instance can be
+       shared by multiple threads. The connection borrowed by a thread is
+       retained until the outermost call (or with block) completes so nested
+       calls use the same connection. This class is combined with one of the
+       database specific classes, as in PooledOracleDataSource.
+
+       Connections which have been idle for more than idleTimeout seconds or
+       which were opened more than maxLifetime seconds ago are closed and
+       connections are pinged before they are handed out, if validate is
+       true; the statistics of the pool (including the time spent waiting
+       for a connection) are available from GetPoolStats()."""
+    threadSafe = True
+    minConnections = 0
+    maxConnections = 8
+    idleTimeout = None
+    maxLifetime = None
+    validateConnections = True
+    pingSql = "select 1"
+
+    def __init__(self, connectionFactory, maxConnections = None,
+            minConnections = None, idleTimeout = None, maxLifetime = None,
+            validate = None):
+        if maxConnections is None:
+            maxConnections = self.maxConnections
+        if minConnections is None:
+            minConnections = self.minConnections
+        if idleTimeout is None:
+            idleTimeout = self.idleTimeout
+        if maxLifetime is None:
+            maxLifetime = self.maxLifetime
+        if validate is None:
+            validate = self.validateConnections
+        self.local = threading.local()
+        self._Initialize()
+        self.pool = cx_Threads.ResourcePool(maxConnections,
+                connectionFactory, minConnections, idleTimeout, maxLifetime,
+                self._PingConnection if validate else None,
+                self._CloseConnection)
+
+    def __enter__(self):
+        return self._AcquireConnection().cursor
+
+    def __exit__(self, excType, excValue, tb):
+        borrowedConnection = self.local.borrowedConnection
+        try:
+            if borrowedConnection.depth == 1:
+                connection = borrowedConnection.connection
+                if excType is None and excValue is None and tb is None:
+                    connection.commit()
+                else:
+                    connection.rollback()
+        finally:
+            self._ReleaseConnection(borrowedConnection)
+
+    def _AcquireConnection(self):
+        borrowedConnection = getattr(self.local, "borrowedConnection", None)
+        if borrowedConnection is None:
+            connection = self.pool.Get()
+            try:
+                borrowedConnection = BorrowedConnection(connection)
+            except:
+                self.pool.Put(connection, addToFreeList = False)
+                raise
+            self.local.borrowedConnection = borrowedConnection
+        borrowedConnection.depth += 1
+        return borrowedConnection
+
+    def _CloseConnection(self, connection):
+        connection.close()
+
+    def _GetBorrowedConnection(self):
+        borrowedConnection = getattr(self.local, "borrowedConnection", None)
+        if borrowedConnection is None:
+            raise ConnectionNotAcquired()
+        return borrowedConnection
+
+    def _PingConnection(self, connection):
+        ping = getattr(connection, "ping", None)
+        if ping is not None:
+            ping()
+        else:
+            cursor = connection.cursor()
+            cursor.execute(self.pingSql)
+            cursor.fetchall()
+        return True
+
+    def _ReleaseConnection(self, borrowedConnection):
+        borrowedConnection.depth -= 1
+        if borrowedConnection.depth == 0:
+            if getattr(self.local, "borrowedConnection", None) \
+                    is borrowedConnection:
+                self.local.borrowedConnection = None
+            self.pool.Put(borrowedConnection.connection)
+
+    @property
+    def connection(self):
+        return self._GetBorrowedConnection().connection
+
+    @property
+    def cursor(self):
+        return self._GetBorrowedConnection().cursor
+
+    def CallFunction(self, functionName, returnType, *args):
+        borrowedConnection = self._AcquireConnection()
+        try:
+            return super(PooledDatabaseDataSource, self).CallFunction(
+                    functionName, returnType, *args)
+        finally:
+            self._ReleaseConnection(borrowedConnection)
+
+    def CallProcedure(self, procedureName, *args):
+        borrowedConnection = self._AcquireConnection()
+        try:
+            return super(PooledDatabaseDataSource, self).CallProcedure(
+                    procedureName, *args)
+        finally:
+            self._ReleaseConnection(borrowedConnection)
+
+    def CommitTransaction(self, transaction):
+        borrowedConnection = self._AcquireConnection()
+        try:
+            super(PooledDatabaseDataSource, self).CommitTransaction(
+                    transaction)
+        finally:
+            self._ReleaseConnection(borrowedConnection)
+
+    def GetRowsDirect(self, sql, args = None, rowFactory = None):
+        borrowedConnection = self._AcquireConnection()
+        try:
+            return super(PooledDatabaseDataSource, self).GetRowsDirect(sql,
+                    args, rowFactory)
+        finally:
+            self._ReleaseConnection(borrowedConnection)
+
+    def GetPoolStats(self):
+        return self.pool.GetStats()
+
+    def GetSequenceValues(self, sequenceName, numValues = 1, cursor = None):
+        borrowedConnection = self._AcquireConnection()
+        try:
+            return super(PooledDatabaseDataSource, self).GetSequenceValues(
+                    sequenceName, numValues, cursor)
+        finally:
+            self._ReleaseConnection(borrowedConnection)
+
+    def IterRowsDirect(self, sql, args = None, rowFactory = None,
+            arraySize = None):
+        borrowedConnection = self._AcquireConnection()
+        try:
+            rows = super(PooledDatabaseDataSource, self).IterRowsDirect(sql,
+                    args, rowFactory, arraySize)
+            for row in rows:
+                yield row
+        finally:
+            self._ReleaseConnection(borrowedConnection)
+
+
+class PooledOracleDataSource(PooledDatabaseDataSource, OracleDataSource):
+    pingSql = "select 1 from dual"
+
+
+class PooledODBCDataSource(PooledDatabaseDataSource, ODBCDataSource):
+    pass
+
+
+class BorrowedConnection(object):
+    """Connection borrowed from the pool of a pooled data source by a
+       thread."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.cursor()
+        self.depth = 0
+
+
+class ConnectionNotAcquired(cx_Exceptions.BaseException):
+    message = "No connection has been acquired from the pool by this " \
+              "thread; use the data source in a with statement."
+
+
+class BindMarker(object):
+    """Placeholder used in place of a value when generating a statement, which
+       allows the layout of the bind variables to be determined."""
+
+    def __init__(self, name, index = None):
+        self.name = name
+        self.index = index
+
+    def __repr__(self):
+        return "<BindMarker %s[%s]>" % (self.name, self.index)
+
+
+class ResultCache(object):
+    """Least recently used cache of the rows returned by queries, keyed by
+       the statement and its arguments. Entries expire after timeToLive
+       seconds (if specified) and the least recently used entries are removed
+       when more than maxEntries entries are cached or when the estimated
+       size of the cached rows exceeds maxBytes. Only queries on the tables
+       in tableNames are cached, unless tableNames is None, in which case
+       queries on all tables are cached. The rows are shared by all callers
+       and must not be modified."""
+
+    def __init__(self, maxEntries = 1000, timeToLive = None,
+            maxBytes = None, tableNames = None):
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.maxEntries = maxEntries
+        self.timeToLive = timeToLive
+        self.maxBytes = maxBytes
+        self.tableNames = None
+        if tableNames is not None:
+            self.tableNames = set(n.lower() for n in tableNames)
+        self.numBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.tableStats = {}
+
+    def _EstimateSize(self, rows):
+        size = sys.getsizeof(rows)
+        if rows:
+            row = rows[0]
+            rowSize = sys.getsizeof(row)
+            if hasattr(row, "__dict__"):
+                values = list(row.__dict__.values())
+            elif hasattr(row, "__slots__"):
+                values = [getattr(row, n, None) for n in row.__slots__]
+            else:
+                values = row
+            rowSize += sum(sys.getsizeof(v) for v in values)
+            size += rowSize * len(rows)
+        return size
+
+    def _GetTableNames(self, tableName):
+        return frozenset(p.split()[0].lower() for p in tableName.split(",") \
+                if p.strip())
+
+    def _RemoveEntry(self, key):
+        rows, tableNames, expiryTime, size = self.entries.pop(key)
+        self.numBytes -= size
+
+    def _UpdateTableStats(self, tableName, hit):
+        stats = self.tableStats.get(tableName)
+        if stats is None:
+            stats = self.tableStats[tableName] = [0, 0]
+        stats[0 if hit else 1] += 1
+
+    def AddTable(self, tableName):
+        with self.lock:
+            if self.tableNames is None:
+                self.tableNames = set()
+            self.tableNames.add(tableName.lower())
+
+    def Clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.numBytes = 0
+            self.invalidations += 1
+
+    def Get(self, key, tableName):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] is not None \
+                    and entry[2] < time.time():
+                self._RemoveEntry(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                self._UpdateTableStats(tableName, False)
+                return None
+            self.hits += 1
+            self._UpdateTableStats(tableName, True)
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def GetStats(self):
+        with self.lock:
+            tableStats = dict((n, dict(hits = h, misses = m)) \
+                    for n, (h, m) in self.tableStats.items())
+            return dict(hits = self.hits, misses = self.misses,
+                    evictions = self.evictions,
+                    invalidations = self.invalidations,
+                    size = len(self.entries), bytes = self.numBytes,
+                    tables = tableStats)
+
+    def InvalidateTable(self, tableName):
+        tableName = tableName.lower()
+        with self.lock:
+            keys = [k for k, e in self.entries.items() if tableName in e[1]]
+            for key in keys:
+                self._RemoveEntry(key)
+            self.invalidations += 1
+
+    def IsCached(self, tableName):
+        if self.tableNames is None:
+            return True
+        return self._GetTableNames(tableName) <= self.tableNames
+
+    def Set(self, key, tableName, rows):
+        size = self._EstimateSize(rows)
+        if self.maxBytes is not None and size > self.maxBytes:
+            return
+        expiryTime = None
+        if self.timeToLive is not None:
+            expiryTime = time.time() + self.timeToLive
+        tableNames = self._GetTableNames(tableName)
+        with self.lock:
+            if key in self.entries:
+                self._RemoveEntry(key)
+            self.entries[key] = (rows, tableNames, expiryTime, size)
+            self.numBytes += size
+            while len(self.entries) > self.maxEntries or \
+                    (self.maxBytes is not None \
+                            and self.numBytes > self.maxBytes):
+                key = next(iter(self.entries))
+                self._RemoveEntry(key)
+                self.evictions += 1
+
+
+class StatementCache(object):
+    """Least recently used cache of generated statements, keyed by the shape
+       of the statement, which tracks the number of hits and misses."""
+
+    def __init__(self, maxSize):
+        self.lock = threading.Lock()
+        self.statements = collections.OrderedDict()
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+
+    def Clear(self):
+        with self.lock:
+            self.statements.clear()
+
+    def Get(self, key):
+        with self.lock:
+            value = self.statements.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.statements.move_to_end(key)
+            return value
+
+    def GetStats(self):
+        with self.lock:
+            return dict(hits = self.hits, misses = self.misses,
+                    size = len(self.statements))
+
+    def Set(self, key, value):
+        with self.lock:
+            self.statements[key] = value
+            while len(self.statements) > self.maxSize:
+                self.statements.popitem(last = False)
 
 
 class Transaction(object):
@@ -404,20 +1158,21 @@ class Transaction(object):
 
     def ModifyRow(self, dataSet, row, origRow):
         if dataSet.updatePackageName is not None:
+            updateAttrNames = dataSet.updateAttrNames
             args = dataSet._GetArgsFromNames(row.pkAttrNames, origRow) + \
-                    dataSet._GetArgsFromNames(dataSet.updateAttrNames, row)
+                    dataSet._GetArgsFromNames(updateAttrNames, row)
             procedureName = "%s.%s" % \
                     (dataSet.updatePackageName, dataSet.updateProcedureName)
             item = self.AddItem(procedureName = procedureName, args = args)
         else:
-            args = dataSet._GetArgsFromNames(dataSet.updateAttrNames, row)
-            setValues = dict(zip(dataSet.updateAttrNames, args))
+            updateAttrNames = dataSet._GetChangedUpdateAttrNames(row, origRow)
+            args = dataSet._GetArgsFromNames(updateAttrNames, row)
+            setValues = dict(zip(updateAttrNames, args))
             args = dataSet._GetArgsFromNames(row.pkAttrNames, origRow)
             conditions = dict(zip(row.pkAttrNames, args))
             item = self.AddItem(tableName = dataSet.updateTableName,
                     setValues = setValues, conditions = conditions)
-        item._SetArgTypes(dataSet, row,
-                row.pkAttrNames + dataSet.updateAttrNames)
+        item._SetArgTypes(dataSet, row, row.pkAttrNames + updateAttrNames)
         return item
 
     def RemoveRow(self, dataSet, row):
@@ -2,9 +2,19 @@
 Define classes and methods suitable for accessing databases in a generic way.
 """
 
+import bisect
+import cx_Exceptions
 import cx_Logging
+import cx_Threads
 import datetime
 import decimal
+import itertools
+import weakref
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 def _NormalizeValue(bases, classDict, name, split = True):
     """Helper routine for row metaclass."""
@@ -20,9 +30,128 @@ def _NormalizeValue(bases, classDict, name, split = True):
     return value
 
 
+def _GetConversion(classDict, attrName, valueName):
+    """Helper routine for row metaclass which returns the expression used to
+       convert the raw value of the attribute as fetched from the database."""
+    if attrName in classDict["charBooleanAttrNames"]:
+        return '%s in ("Y", "1", True)' % valueName
+    elif attrName in classDict["charDateAttrNames"]:
+        return 'datetime.datetime.strptime(%s, "%s") ' \
+                'if isinstance(%s, str) else %s' % \
+                (valueName, classDict["charDateFormat"], valueName, valueName)
+    elif attrName in classDict["decimalAttrNames"]:
+        return 'decimal.Decimal(%s) if %s is not None else None' % \
+                (valueName, valueName)
+    elif attrName in classDict["lazyLobAttrNames"]:
+        format = '%s if %s is None or isinstance(%s, (str, bytes, ' \
+                'LobProxy)) else LobProxy(%s)'
+        return format % (valueName, valueName, valueName, valueName)
+    elif attrName in classDict["clobAttrNames"]:
+        format = '%s if %s is None or isinstance(%s, str) else %s.read()'
+        return format % (valueName, valueName, valueName, valueName)
+    elif attrName in classDict["blobAttrNames"]:
+        format = '%s if %s is None or isinstance(%s, bytes) else %s.read()'
+        return format % (valueName, valueName, valueName, valueName)
+    return valueName
+
+
+def _GetArray(rowClass, attrName, values):
+    """Return a NumPy array for the values of the attribute; the type of the
+       array is determined by the type of the attribute or the type of the
+       values. Null values are masked, in which case a masked array is
+       returned."""
+    if attrName in rowClass.charBooleanAttrNames:
+        return numpy.array([v in ("Y", "1", True) for v in values],
+                dtype = bool)
+    mask = [v is None for v in values]
+    hasNulls = any(mask)
+    sample = next((v for v in values if v is not None), None)
+    if attrName in rowClass.charDateAttrNames and isinstance(sample, str):
+        dateFormat = rowClass.charDateFormat
+        values = [datetime.datetime.strptime(v, dateFormat) \
+                if v is not None else None for v in values]
+        sample = values[mask.index(False)]
+    fillValue = None
+    if attrName in rowClass.decimalAttrNames \
+            or isinstance(sample, (decimal.Decimal, float)):
+        dataType, fillValue = numpy.float64, 0.0
+    elif isinstance(sample, datetime.datetime):
+        dataType = "datetime64[us]"
+    elif isinstance(sample, datetime.date):
+        dataType = "datetime64[D]"
+    elif isinstance(sample, bool):
+        dataType, fillValue = bool, False
+    elif isinstance(sample, int):
+        dataType, fillValue = numpy.int64, 0
+    else:
+        dataType = object
+    if hasNulls and fillValue is not None:
+        values = [fillValue if v is None else v for v in values]
+    array = numpy.array(values, dtype = dataType)
+    if hasNulls:
+        array = numpy.ma.MaskedArray(array, mask = mask)
+    return array
+
+
+def _GetArrays(rowClass, attrNames, columns):
+    """Return a dictionary of NumPy arrays for the given columns of values,
+       which must be in the same order as the attribute names."""
+    if numpy is None:
+        raise NumPyNotAvailable()
+    return dict((n, _GetArray(rowClass, n, list(c))) \
+            for n, c in zip(attrNames, columns))
+
+
+def _GetRawAttribute(row, attrName):
+    """Return the value of the attribute without reading the LOB if the
+       attribute is a lazily read LOB."""
+    return getattr(row, _GetStorageName(row, attrName))
+
+
+def _GetSortRep(value):
+    """Return the representation of the value used for sorting, in the same
+       way as Row.SortValue()."""
+    if isinstance(value, str):
+        return value.upper()
+    elif isinstance(value, (datetime.datetime, datetime.date)):
+        return str(value)
+    return value
+
+
+def _GetStorageName(row, attrName):
+    """Return the name under which the value of the attribute is stored,
+       which differs from the name of the attribute for lazily read LOBs."""
+    if attrName in row.lazyLobAttrNames:
+        return "_" + attrName
+    return attrName
+
+
+def _LobProperty(attrName):
+    """Return a property for a lazily read LOB attribute which reads the LOB
+       the first time the attribute is accessed."""
+    storageName = "_" + attrName
+
+    def GetValue(self):
+        value = getattr(self, storageName)
+        if isinstance(value, LobProxy):
+            value = value.Read()
+            setattr(self, storageName, value)
+        return value
+
+    def SetValue(self, value):
+        setattr(self, storageName, value)
+
+    return property(GetValue, SetValue)
+
+
 class RowMetaClass(type):
     """Metaclass for rows which automatically builds a constructor function
-       which can then be used by ceODBC and cx_Oracle as a row factory."""
+       which can then be used by ceODBC and cx_Oracle as a row factory, as
+       well as a class method FromTuples() which builds rows for a whole batch
+       of fetched tuples at once, converting the values a column at a
+       time, and a class method ColumnsFromTuples() which converts a batch of
+       fetched tuples in the same way but returns the lists of values for
+       each attribute instead of building rows."""
 
     def __new__(cls, name, bases, classDict):
         attrNames = _NormalizeValue(bases, classDict, "attrNames")
@@ -35,6 +164,11 @@ class RowMetaClass(type):
                 _NormalizeValue(bases, classDict, "decimalAttrNames")
         clobAttrNames = _NormalizeValue(bases, classDict, "clobAttrNames")
         blobAttrNames = _NormalizeValue(bases, classDict, "blobAttrNames")
+        lazyLobs = _NormalizeValue(bases, classDict, "lazyLobs")
+        lazyLobAttrNames = classDict["lazyLobAttrNames"] = \
+                [n for n in attrNames \
+                        if lazyLobs and (n in clobAttrNames \
+                                or n in blobAttrNames)]
         pkAttrNames = _NormalizeValue(bases, classDict, "pkAttrNames")
         sortByAttrNames = _NormalizeValue(bases, classDict, "sortByAttrNames")
         sortReversed = _NormalizeValue(bases, classDict, "sortReversed")
@@ -54,39 +188,137 @@ class RowMetaClass(type):
             tableName = "%s.%s" % (schemaName, tableName)
         classDict["tableName"] = tableName
         if useSlots:
-            classDict["__slots__"] = attrNames + extraAttrNames
+            classDict["__slots__"] = \
+                    ["_" + n if n in lazyLobAttrNames else n \
+                            for n in attrNames + extraAttrNames]
+        for attrName in lazyLobAttrNames:
+            if attrName not in classDict:
+                classDict[attrName] = _LobProperty(attrName)
         if "reprName" not in classDict:
             classDict["reprName"] = name
         initLines = []
         for attrName in attrNames + extraAttrNames:
-            if attrName in charBooleanAttrNames:
-                value = '%s in ("Y", "1", True)' % attrName
-            elif attrName in charDateAttrNames:
-                value = 'datetime.datetime.strptime(%s, "%s") ' \
-                        'if isinstance(%s, str) else %s' % \
-                        (attrName, charDateFormat, attrName, attrName)
-            elif attrName in decimalAttrNames:
-                value = 'decimal.Decimal(%s) if %s is not None else None' % \
-                        (attrName, attrName)
-            elif attrName in clobAttrNames:
-                format = '%s if %s is None or isinstance(%s, str) ' \
-                         'else %s.read()'
-                value = format % (attrName, attrName, attrName, attrName)
-            elif attrName in blobAttrNames:
-                format = '%s if %s is None or isinstance(%s, bytes) ' \
-                         'else %s.read()'
-                value = format % (attrName, attrName, attrName, attrName)
-            else:
-                value = "%s" % attrName
+            value = _GetConversion(classDict, attrName, attrName)
             initLines.append("    self.%s = %s\n" % (attrName, value))
         initArgs = attrNames + ["%s = None" % n for n in extraAttrNames]
         if initArgs:
             codeString = "def __init__(self, %s):\n%s" % \
                     (", ".join(initArgs), "".join(initLines))
             code = compile(codeString, "GeneratedClass.py", "exec")
-            exec(code, dict(datetime = datetime, decimal = decimal), classDict)
+            exec(code, dict(datetime = datetime, decimal = decimal,
+                    LobProxy = LobProxy), classDict)
+        if attrNames:
+            columnNames = ["c%d" % i for i in range(len(attrNames))]
+            valueNames = ["v%d" % i for i in range(len(attrNames))]
+            conversionLines = \
+                    ["    %s, = zip(*rows)\n" % ", ".join(columnNames)]
+            columnValues = []
+            for attrName, columnName in zip(attrNames, columnNames):
+                value = _GetConversion(classDict, attrName, "v")
+                if value == "v":
+                    columnValues.append("list(%s)" % columnName)
+                else:
+                    columnValues.append(columnName)
+                    conversionLines.append("    %s = [%s for v in %s]\n" % \
+                            (columnName, value, columnName))
+            lines = [
+                    "    if not rows:\n",
+                    "        return []\n"
+            ]
+            lines.extend(conversionLines)
+            lines.append("    new = cls.__new__\n")
+            lines.append("    result = []\n")
+            lines.append("    append = result.append\n")
+            lines.append("    for %s, in zip(%s):\n" % \
+                    (", ".join(valueNames), ", ".join(columnNames)))
+            lines.append("        self = new(cls)\n")
+            for attrName, valueName in zip(attrNames, valueNames):
+                lines.append("        self.%s = %s\n" % (attrName, valueName))
+            for attrName in extraAttrNames:
+                value = _GetConversion(classDict, attrName, "None")
+                lines.append("        self.%s = %s\n" % (attrName, value))
+            lines.append("        append(self)\n")
+            lines.append("    return result\n")
+            codeString = "def FromTuples(cls, rows):\n%s" % "".join(lines)
+            code = compile(codeString, "GeneratedClass.py", "exec")
+            temp = {}
+            exec(code, dict(datetime = datetime, decimal = decimal,
+                    LobProxy = LobProxy), temp)
+            classDict["FromTuples"] = classmethod(temp["FromTuples"])
+            lines = [
+                    "    if not rows:\n",
+                    "        return [[] for i in range(%d)]\n" % \
+                            (len(attrNames) + len(extraAttrNames))
+            ]
+            lines.extend(conversionLines)
+            for attrName in extraAttrNames:
+                value = _GetConversion(classDict, attrName, "None")
+                columnValues.append("[%s] * len(rows)" % value)
+            lines.append("    return [%s]\n" % ", ".join(columnValues))
+            codeString = "def ColumnsFromTuples(cls, rows):\n%s" % \
+                    "".join(lines)
+            code = compile(codeString, "GeneratedClass.py", "exec")
+            temp = {}
+            exec(code, dict(datetime = datetime, decimal = decimal,
+                    LobProxy = LobProxy), temp)
+            classDict["ColumnsFromTuples"] = \
+                    classmethod(temp["ColumnsFromTuples"])
         return type.__new__(cls, name, bases, classDict)
 
+    def GetColumnarViewClass(cls):
+        viewClass = cls.__dict__.get("_columnarViewClass")
+        if viewClass is None:
+            slots = ["_store", "_position"]
+            if not hasattr(cls, "__weakref__"):
+                slots.append("__weakref__")
+            classDict = dict(__slots__ = slots, useSlots = False,
+                    tableName = cls.tableName, reprName = cls.reprName,
+                    Copy = _CopyColumnarView)
+            for attrName in cls.attrNames + cls.extraAttrNames:
+                classDict[attrName] = _ColumnarProperty(attrName)
+            for attrName in cls.lazyLobAttrNames:
+                classDict["_" + attrName] = \
+                        _ColumnarProperty(attrName, readLobs = False)
+            viewClass = RowMetaClass(cls.__name__, (cls,), classDict)
+            cls._columnarViewClass = viewClass
+        return viewClass
+
+    def GetProjectedClass(cls, attrNames):
+        """Return a subclass of the row class which is populated with only the
+           given attributes (and the primary key attributes) when rows are
+           fetched; the remaining attributes are fetched by primary key the
+           first time any of them is accessed. The row class itself is
+           returned if all attributes are included or there is no primary
+           key."""
+        projectedAttrNames = [n for n in cls.attrNames \
+                if n in attrNames or n in cls.pkAttrNames]
+        if not cls.pkAttrNames or len(projectedAttrNames) == len(cls.attrNames):
+            return cls
+        projectedClasses = cls.__dict__.get("_projectedClasses")
+        if projectedClasses is None:
+            projectedClasses = cls._projectedClasses = {}
+        key = tuple(projectedAttrNames)
+        projectedClass = projectedClasses.get(key)
+        if projectedClass is None:
+            reprAttrNames = [n for n in cls.reprAttrNames or cls.attrNames \
+                    if n in projectedAttrNames]
+            classDict = dict(__slots__ = ["_dataSource"], useSlots = False,
+                    attrNames = projectedAttrNames, tableName = cls.tableName,
+                    reprName = cls.reprName, reprAttrNames = reprAttrNames,
+                    __getattr__ = _GetProjectedAttribute,
+                    Copy = _CopyProjectedRow)
+            projectedClass = RowMetaClass(cls.__name__, (cls,), classDict)
+            projectedClass.attrNames = cls.attrNames
+            projectedClass.lazyLobAttrNames = cls.lazyLobAttrNames
+            projectedClass.projectedAttrNames = projectedAttrNames
+            projectedClass.projectedIndexes = \
+                    [cls.attrNames.index(n) for n in projectedAttrNames]
+            projectedClass.unfetchedAttrNames = \
+                    [n for n in cls.attrNames if n not in projectedAttrNames]
+            projectedClass.fullRowClass = cls
+            projectedClasses[key] = projectedClass
+        return projectedClass
+
     def New(cls):
         args = [None] * len(cls.attrNames)
         return cls(*args)
@@ -103,12 +335,14 @@ class Row(object, metaclass = RowMetaClass):
     decimalAttrNames = []
     clobAttrNames = []
     blobAttrNames = []
+    lazyLobs = False
     sortByAttrNames = []
     reprAttrNames = []
     pkAttrNames = []
     useSlots = True
     generateTableName = True
     sortReversed = False
+    sortInDatabase = False
     schemaName = None
     tableName = None
 
@@ -139,25 +373,136 @@ class Row(object, metaclass = RowMetaClass):
         return row
 
     @classmethod
-    def GetRows(cls, dataSource, **conditions):
+    def _GetDatabaseOrderBy(cls, dataSource, selectNames):
+        """Return the columns by which the database should sort the rows or
+           None if they are to be sorted by SortValue() after they have been
+           fetched. Sorting is only done by the database if sortInDatabase is
+           true (the collation of the database may differ from the case
+           insensitive comparison performed by SortValue()), the data source
+           supports it and the attributes are all selected directly from the
+           table."""
+        if not cls.sortByAttrNames or not cls.sortInDatabase \
+                or not dataSource.supportsOrderBy \
+                or list(selectNames) != cls.attrNames \
+                or any(n not in cls.attrNames for n in cls.sortByAttrNames):
+            return None
+        orderBy = list(cls.sortByAttrNames)
+        if cls.sortReversed:
+            orderBy = ["-" + n for n in orderBy]
+        return orderBy
+
+    @classmethod
+    def _GetProjection(cls, projection, selectNames):
+        rowClass = cls
+        if projection is not None and len(selectNames) == len(cls.attrNames):
+            rowClass = cls.GetProjectedClass(projection)
+            if rowClass is not cls:
+                selectNames = [selectNames[i] \
+                        for i in rowClass.projectedIndexes]
+        return rowClass, selectNames
+
+    @classmethod
+    def GetRows(cls, dataSource, _orderBy = None, _limit = None,
+            _offset = None, _after = None, _projection = None, **conditions):
+        """Return the rows matching the conditions, sorted after they have
+           been fetched (or by the database if sortInDatabase is true, see
+           _GetDatabaseOrderBy()). If _projection is specified, only those
+           attributes (and the primary key) are fetched; the others are
+           fetched for each row when first accessed. See
+           DataSource.GetSqlAndArgs() for the meaning of the remaining
+           arguments."""
         tableName, selectNames, queryConditions = \
                 cls.GetQueryInfo(**conditions)
-        rows = dataSource.GetRows(tableName, selectNames, cls,
+        if _orderBy is None:
+            _orderBy = cls._GetDatabaseOrderBy(dataSource, selectNames)
+        rowClass, selectNames = cls._GetProjection(_projection, selectNames)
+        if _orderBy is not None or _limit is not None \
+                or _offset is not None or _after is not None:
+            queryConditions = dict(queryConditions, _orderBy = _orderBy,
+                    _limit = _limit, _offset = _offset, _after = _after)
+        rows = dataSource.GetRows(tableName, selectNames, rowClass,
                 **queryConditions)
+        if rowClass is not cls:
+            for row in rows:
+                row._dataSource = dataSource
         cls.SetExtraAttributes(dataSource, rows)
-        if cls.sortByAttrNames:
+        if cls.sortByAttrNames and _orderBy is None:
             rows.sort(key = cls.SortValue)
             if cls.sortReversed:
                 rows.reverse()
         return rows
 
+    @classmethod
+    def GetArrays(cls, dataSource, _attrNames = None, _orderBy = None,
+            **conditions):
+        """Return a dictionary of NumPy arrays, one for each of the given
+           attributes (or all attributes), containing the values of the rows
+           matching the conditions; the values are fetched as tuples and
+           placed directly in the arrays without building any row objects.
+           Null values are masked and dates are returned as datetime64
+           values. The rows are in the order in which GetRows() would return
+           them only if they are sorted by the database (see
+           _GetDatabaseOrderBy()) or _orderBy is specified."""
+        if numpy is None:
+            raise NumPyNotAvailable()
+        tableName, selectNames, queryConditions = \
+                cls.GetQueryInfo(**conditions)
+        if _orderBy is None:
+            _orderBy = cls._GetDatabaseOrderBy(dataSource, selectNames)
+        if _orderBy is not None:
+            queryConditions = dict(queryConditions, _orderBy = _orderBy)
+        indexes = [i for i, n in enumerate(cls.attrNames) \
+                if _attrNames is None or n in _attrNames]
+        attrNames = [cls.attrNames[i] for i in indexes]
+        selectNames = [selectNames[i] for i in indexes]
+        rows = dataSource.GetRows(tableName, selectNames, None,
+                **queryConditions)
+        columns = list(zip(*rows)) if rows else [()] * len(attrNames)
+        return _GetArrays(cls, attrNames, columns)
+
+    @classmethod
+    def IterRows(cls, dataSource, _arraySize = None, _projection = None,
+            **conditions):
+        """Return an iterator over the rows matching the conditions which
+           fetches the rows from the data source in batches rather than all
+           at once; note that the rows are not sorted."""
+        tableName, selectNames, queryConditions = \
+                cls.GetQueryInfo(**conditions)
+        rowClass, selectNames = cls._GetProjection(_projection, selectNames)
+        arraySize = _arraySize or dataSource.arraySize
+        rows = dataSource.IterRows(tableName, selectNames, rowClass,
+                arraySize, **queryConditions)
+        while True:
+            batch = list(itertools.islice(rows, arraySize))
+            if not batch:
+                break
+            if rowClass is not cls:
+                for row in batch:
+                    row._dataSource = dataSource
+            cls.SetExtraAttributes(dataSource, batch)
+            for row in batch:
+                yield row
+
     @classmethod
     def SetExtraAttributes(cls, dataSource, rows):
         pass
 
+    @classmethod
+    def ReadLobs(cls, rows, attrNames = None):
+        """Read all of the lazily read LOBs in the rows which have not been
+           read yet, optionally restricted to the given attributes; this
+           should be done before the connection used to fetch the rows is
+           closed or returned to a pool."""
+        if attrNames is None:
+            attrNames = cls.lazyLobAttrNames
+        for row in rows:
+            for attrName in attrNames:
+                if isinstance(row.GetLobProxy(attrName), LobProxy):
+                    getattr(row, attrName)
+
     def Copy(self):
         cls = self.__class__
-        args = [getattr(self, n) for n in cls.attrNames]
+        args = [_GetRawAttribute(self, n) for n in cls.attrNames]
         row = cls(*args)
         for name in cls.extraAttrNames:
             if hasattr(self, name):
@@ -167,6 +512,14 @@ class Row(object, metaclass = RowMetaClass):
     def GetAttributeNames(self):
         return self.attrNames + self.extraAttrNames
 
+    def GetLobProxy(self, attrName):
+        """Return the proxy for a lazily read LOB attribute, which allows the
+           LOB to be read in chunks, or None if it has already been read."""
+        if attrName in self.lazyLobAttrNames:
+            value = _GetRawAttribute(self, attrName)
+            if isinstance(value, LobProxy) and not value.isRead:
+                return value
+
     def GetPrimaryKeyTuple(self):
         return tuple([getattr(self, n) for n in self.pkAttrNames])
 
@@ -189,6 +542,422 @@ class Row(object, metaclass = RowMetaClass):
         return tuple(values)
 
 
+def _ColumnarProperty(attrName, readLobs = True):
+    """Helper routine for building the properties of columnar row views."""
+
+    def GetValue(self):
+        value = self._store.columns[attrName][self._position]
+        if readLobs and isinstance(value, LobProxy):
+            value = value.Read()
+            self._store.columns[attrName][self._position] = value
+        return value
+
+    def SetValue(self, value):
+        self._store.columns[attrName][self._position] = value
+
+    return property(GetValue, SetValue)
+
+
+def _AttributeChanged(row, origRow, attrName):
+    """Return true if the value of the attribute differs between the row and
+       the original row; attributes of projected rows which have not been
+       fetched and lazily read LOBs are compared without being read."""
+    storageName = _GetStorageName(row, attrName)
+    hasValue = _HasAttribute(row, storageName)
+    if hasValue != _HasAttribute(origRow, storageName):
+        return True
+    if not hasValue:
+        return False
+    value = object.__getattribute__(row, storageName)
+    origValue = object.__getattribute__(origRow, storageName)
+    if value is origValue:
+        return False
+    if isinstance(value, LobProxy) and value.isRead:
+        value = value.value
+    if isinstance(origValue, LobProxy) and origValue.isRead:
+        origValue = origValue.value
+    return value != origValue
+
+
+def _CopyColumnarView(self):
+    """Copy method for columnar row views which returns a detached row."""
+    return self._store.BuildRow(self._position)
+
+
+def _GetProjectedAttribute(self, name):
+    """Method __getattr__() for projected row classes which fetches the
+       attributes that were not included in the projection when the first of
+       them is accessed."""
+    cls = self.__class__
+    if name not in cls.unfetchedAttrNames:
+        raise AttributeError(name)
+    conditions = dict((n, getattr(self, n)) for n in cls.pkAttrNames)
+    row = cls.fullRowClass.GetRow(self._dataSource, **conditions)
+    for attrName in cls.unfetchedAttrNames:
+        storageName = _GetStorageName(self, attrName)
+        if not _HasAttribute(self, storageName):
+            setattr(self, storageName, _GetRawAttribute(row, attrName))
+    return object.__getattribute__(self, name)
+
+
+def _CopyProjectedRow(self):
+    """Copy method for projected rows which does not fetch the attributes
+       that were not included in the projection."""
+    cls = self.__class__
+    row = cls(*[_GetRawAttribute(self, n) for n in cls.projectedAttrNames])
+    for name in cls.unfetchedAttrNames + cls.extraAttrNames + ["_dataSource"]:
+        name = _GetStorageName(self, name)
+        if _HasAttribute(self, name):
+            setattr(row, name, object.__getattribute__(self, name))
+    return row
+
+
+def _HasAttribute(obj, name):
+    """Return true if the attribute has been set on the object without
+       invoking __getattr__()."""
+    try:
+        object.__getattribute__(obj, name)
+    except AttributeError:
+        return False
+    return True
+
+
+class LobProxy(object):
+    """Proxy for a LOB locator fetched for a lazily read LOB attribute which
+       defers reading the value of the LOB until it is first needed. The value
+       is retained once read so that rows sharing the proxy (such as copies of
+       the row) only read the LOB once."""
+    __slots__ = ["lob", "value", "isRead"]
+
+    def __init__(self, lob):
+        self.lob = lob
+        self.value = None
+        self.isRead = False
+
+    def __repr__(self):
+        return "<LobProxy: isRead=%s>" % self.isRead
+
+    def Read(self):
+        if not self.isRead:
+            self.value = self.lob.read()
+            self.isRead = True
+            self.lob = None
+        return self.value
+
+    def ReadChunks(self, chunkSize = None):
+        """Return an iterator which reads the LOB in chunks of the given size
+           (or the chunk size of the LOB, if not specified) without retaining
+           the value, so that large LOBs can be streamed."""
+        if self.isRead:
+            if self.value:
+                yield self.value
+            return
+        lob = self.lob
+        if chunkSize is None:
+            chunkSize = lob.getchunksize()
+        offset = 1
+        while True:
+            data = lob.read(offset, chunkSize)
+            if not data:
+                break
+            yield data
+            offset += len(data)
+
+    def Size(self):
+        if self.isRead:
+            return 0 if self.value is None else len(self.value)
+        return self.lob.size()
+
+
+class ColumnarRowStore(object):
+    """Mapping of row handles to rows which retains the values of retrieved
+       rows in per-attribute lists rather than in individual row objects; the
+       handle of a retrieved row is its position in the lists. Row objects
+       are built lazily as lightweight views only when a row is accessed.
+       Rows assigned directly (inserted or modified rows) are retained as
+       is."""
+
+    def __init__(self, rowClass, rows = []):
+        self.rowClass = rowClass
+        self.viewClass = rowClass.GetColumnarViewClass()
+        self.attrNames = rowClass.attrNames + rowClass.extraAttrNames
+        self.columns = dict((n, []) for n in self.attrNames)
+        self.numPositions = 0
+        self.removedPositions = set()
+        self.assignedRows = {}
+        self.views = weakref.WeakValueDictionary()
+        self.AppendRows(0, rows)
+
+    def __contains__(self, handle):
+        if handle in self.assignedRows:
+            return True
+        return isinstance(handle, int) and 0 <= handle < self.numPositions \
+                and handle not in self.removedPositions
+
+    def __delitem__(self, handle):
+        if handle not in self:
+            raise KeyError(handle)
+        if handle < self.numPositions:
+            self.removedPositions.add(handle)
+        self.assignedRows.pop(handle, None)
+        self.views.pop(handle, None)
+
+    def __getitem__(self, handle):
+        row = self.assignedRows.get(handle)
+        if row is None:
+            row = self.views.get(handle)
+            if row is None:
+                if handle not in self:
+                    raise KeyError(handle)
+                row = self.viewClass.__new__(self.viewClass)
+                row._store = self
+                row._position = handle
+                self.views[handle] = row
+        return row
+
+    def __iter__(self):
+        numPositions = self.numPositions
+        removedPositions = self.removedPositions
+        for handle in range(numPositions):
+            if handle not in removedPositions:
+                yield handle
+        for handle in list(self.assignedRows):
+            if handle >= numPositions:
+                yield handle
+
+    def __len__(self):
+        numAppendedRows = sum(1 for h in self.assignedRows \
+                if h >= self.numPositions)
+        return self.numPositions - len(self.removedPositions) + \
+                numAppendedRows
+
+    def __setitem__(self, handle, row):
+        self.removedPositions.discard(handle)
+        if isinstance(row, self.viewClass) and row._store is self \
+                and row._position == handle:
+            self.assignedRows.pop(handle, None)
+            self.views[handle] = row
+        else:
+            self.assignedRows[handle] = row
+            self.views.pop(handle, None)
+
+    def AppendColumns(self, firstHandle, columns):
+        """Append rows given as lists of values, one for each attribute
+           (followed by the extra attributes) in the order of the attributes
+           of the row class, to the store. The first handle must not be less
+           than the number of positions in the store; any positions skipped
+           are left empty. Empty columns are replaced by the lists given
+           rather than copied."""
+        for position in range(self.numPositions, firstHandle):
+            if position not in self.assignedRows:
+                self.removedPositions.add(position)
+            for values in self.columns.values():
+                values.append(None)
+        numRows = 0
+        for attrName, values in zip(self.attrNames, columns):
+            column = self.columns[attrName]
+            if column:
+                column.extend(values)
+            else:
+                self.columns[attrName] = values
+            numRows = len(values)
+        self.numPositions = max(self.numPositions, firstHandle) + numRows
+
+    def AppendRows(self, firstHandle, rows):
+        columns = [[getattr(r, _GetStorageName(r, n), None) for r in rows] \
+                for n in self.attrNames]
+        self.AppendColumns(firstHandle, columns)
+
+    def BuildRow(self, position):
+        cls = self.rowClass
+        args = [self.columns[n][position] for n in cls.attrNames]
+        row = cls(*args)
+        for attrName in cls.extraAttrNames:
+            setattr(row, attrName, self.columns[attrName][position])
+        return row
+
+    def Sort(self):
+        """Sort the retrieved rows by the sort value of the row class (in the
+           same way as Row.GetRows() does) by reordering the values in the
+           columns; this must be done before any rows are assigned or
+           removed."""
+        sortByAttrNames = self.rowClass.sortByAttrNames
+        if self.viewClass.SortValue is Row.SortValue:
+            columns = [[_GetSortRep(v) for v in self.columns[n]] \
+                    for n in sortByAttrNames]
+            sortValues = columns[0] if len(columns) == 1 \
+                    else list(zip(*columns))
+        else:
+            view = self.viewClass.__new__(self.viewClass)
+            view._store = self
+            sortValues = []
+            for position in range(self.numPositions):
+                view._position = position
+                sortValues.append(view.SortValue())
+        positions = sorted(range(self.numPositions),
+                key = sortValues.__getitem__)
+        if self.rowClass.sortReversed:
+            positions.reverse()
+        for attrName, values in list(self.columns.items()):
+            self.columns[attrName] = [values[i] for i in positions]
+        self.views.clear()
+
+    def clear(self):
+        self.numPositions = 0
+        self.removedPositions.clear()
+        self.assignedRows.clear()
+        self.views.clear()
+        for values in self.columns.values():
+            del values[:]
+
+    def get(self, handle, defaultValue = None):
+        if handle in self:
+            return self[handle]
+        return defaultValue
+
+    def items(self):
+        return [(h, self[h]) for h in self]
+
+    def keys(self):
+        return list(self)
+
+    def pop(self, handle, *args):
+        if handle not in self and args:
+            return args[0]
+        row = self[handle]
+        del self[handle]
+        return row
+
+    def values(self):
+        return [self[h] for h in self]
+
+
+class DataSetIndex(object):
+    """Base class for indexes on the rows of a data set which are maintained
+       incrementally as rows are inserted, deleted and modified through the
+       data set."""
+
+    def __init__(self, dataSet, attrNames):
+        self.dataSet = dataSet
+        self.attrNames = attrNames
+        self.Build()
+
+    def AddRow(self, handle, row):
+        raise NotImplementedError
+
+    def Build(self):
+        self.Clear()
+        for handle, row in self.dataSet.rows.items():
+            self.AddRow(handle, row)
+
+    def Clear(self):
+        raise NotImplementedError
+
+    def RemoveRow(self, handle, row):
+        raise NotImplementedError
+
+    def VerifyValue(self, handle, row, attrName, value):
+        pass
+
+
+class HashIndex(DataSetIndex):
+    """Index which maps the values of the given attributes to the handles of
+       the rows with those values. Unique indexes map each key to a single
+       handle and raise cx_Exceptions.DuplicateKey if a second row with the
+       same key is added; keys containing null values are not indexed by
+       unique indexes."""
+
+    def __init__(self, dataSet, attrNames, unique = False):
+        self.unique = unique
+        super(HashIndex, self).__init__(dataSet, attrNames)
+
+    def _GetKey(self, row, attrName = None, value = None):
+        return tuple([value if n == attrName else getattr(row, n) \
+                for n in self.attrNames])
+
+    def AddRow(self, handle, row):
+        key = self._GetKey(row)
+        if not self.unique:
+            self.handles.setdefault(key, []).append(handle)
+        elif None not in key:
+            existingHandle = self.handles.get(key)
+            if existingHandle is not None and existingHandle != handle:
+                raise cx_Exceptions.DuplicateKey(key = key)
+            self.handles[key] = handle
+
+    def Clear(self):
+        self.handles = {}
+
+    def FindHandle(self, *key):
+        handles = self.handles.get(key)
+        if handles is not None and not self.unique:
+            return handles[0] if handles else None
+        return handles
+
+    def FindHandles(self, *key):
+        handles = self.handles.get(key)
+        if handles is None:
+            return []
+        elif self.unique:
+            return [handles]
+        return list(handles)
+
+    def RemoveRow(self, handle, row):
+        key = self._GetKey(row)
+        handles = self.handles.get(key)
+        if self.unique and handles == handle:
+            del self.handles[key]
+            return
+        elif not self.unique and handles is not None and handle in handles:
+            handles.remove(handle)
+            if not handles:
+                del self.handles[key]
+            return
+        for key, handles in list(self.handles.items()):
+            if handles == handle:
+                del self.handles[key]
+            elif not self.unique and handle in handles:
+                handles.remove(handle)
+                if not handles:
+                    del self.handles[key]
+
+    def VerifyValue(self, handle, row, attrName, value):
+        if self.unique:
+            key = self._GetKey(row, attrName, value)
+            existingHandle = self.handles.get(key)
+            if existingHandle is not None and existingHandle != handle:
+                raise cx_Exceptions.DuplicateKey(key = key)
+
+
+class SortedIndex(DataSetIndex):
+    """Index which keeps the row handles sorted by the values of the given
+       attributes, using the same sort representation as
+       DataSet.GetSortedRowHandles()."""
+
+    def _GetEntry(self, handle, row):
+        return (self.dataSet._GetSortKey(row, self.attrNames), handle)
+
+    def AddRow(self, handle, row):
+        bisect.insort(self.entries, self._GetEntry(handle, row))
+
+    def Clear(self):
+        self.entries = []
+
+    def GetHandles(self):
+        return [h for k, h in self.entries]
+
+    def RemoveRow(self, handle, row):
+        entry = self._GetEntry(handle, row)
+        pos = bisect.bisect_left(self.entries, entry)
+        if pos < len(self.entries) and self.entries[pos] == entry:
+            del self.entries[pos]
+            return
+        for pos, (key, entryHandle) in enumerate(self.entries):
+            if entryHandle == handle:
+                del self.entries[pos]
+                break
+
+
 class DataSetMetaClass(type):
     """Metaclass for data sets which sets up the class used for retrieval and
        other data manipulation routines."""
@@ -205,7 +974,8 @@ class DataSetMetaClass(type):
                     pkAttrNames = cls.pkAttrNames, useSlots = cls.useSlots,
                     sortByAttrNames = cls.sortByAttrNames,
                     sortReversed = cls.sortReversed,
-                    tableName = cls.tableName)
+                    sortInDatabase = cls.sortInDatabase,
+                    lazyLobs = cls.lazyLobs, tableName = cls.tableName)
             cls.rowClass = RowMetaClass("%sRow" % name, (Row,), classDict)
         cls.attrNames = cls.rowClass.attrNames
         cls.pkAttrNames = cls.rowClass.pkAttrNames
@@ -247,25 +1017,59 @@ class DataSet(object, metaclass = DataSetMetaClass):
     decimalAttrNames = []
     clobAttrNames = []
     blobAttrNames = []
+    lazyLobs = False
     retrievalAttrNames = []
     sortByAttrNames = []
     sortReversed = False
+    sortInDatabase = False
     insertAttrNames = []
     updateAttrNames = []
     pkIsGenerated = False
     pkSequenceName = None
     useSlots = True
+    useColumnarStorage = False
+    updateChangedAttrNamesOnly = True
+    projectionAttrNames = None
+    watermarkAttrName = None
+    tombstoneTableName = None
+    tombstoneWatermarkAttrName = None
+    watermark = None
 
     def __init__(self, dataSource, contextItem = None):
         self.dataSource = dataSource
         self.childDataSets = []
         self.contextItem = contextItem
         self.retrievalArgs = [None] * len(self.retrievalAttrNames)
+        self.indexes = []
         if self.updateTableName is None:
             self.updateTableName = self.tableName
         self.OnCreate()
         self.Clear()
 
+    def _AddRowToIndexes(self, handle, row, attrName = None):
+        for index in self.indexes:
+            if attrName is None or attrName in index.attrNames:
+                index.AddRow(handle, row)
+
+    def _AppendRows(self, firstHandle, rows):
+        if self.useColumnarStorage:
+            self.rows.AppendRows(firstHandle, rows)
+        else:
+            self.rows.update(enumerate(rows, firstHandle))
+        for handle in range(firstHandle, firstHandle + len(rows)):
+            self._AddRowToIndexes(handle, self.rows[handle])
+
+    def _CanPrefetch(self):
+        return self.tableName is not None \
+                and len(self.retrievalAttrNames) == 1 \
+                and self.retrievalAttrNames[0] in self.rowClass.attrNames
+
+    def _CanRetrieveColumns(self):
+        cls = self.__class__
+        return self.useColumnarStorage and self.tableName is not None \
+                and cls._GetRows is DataSet._GetRows \
+                and cls._SetRows is DataSet._SetRows
+
     def _DeleteRowsInDatabase(self, transaction):
         for row in self.deletedRows.values():
             self.DeleteRowInDatabase(transaction, row)
@@ -286,6 +1090,56 @@ class DataSet(object, metaclass = DataSetMetaClass):
             args.append(value)
         return args
 
+    def _GetChangedRows(self, watermark):
+        conditions = dict(zip(self.retrievalAttrNames, self.retrievalArgs))
+        conditions[self.watermarkAttrName + "__gte"] = watermark
+        if self.projectionAttrNames is not None \
+                and not self.useColumnarStorage:
+            conditions["_projection"] = self.projectionAttrNames
+        return self.rowClass.GetRows(self.dataSource, **conditions)
+
+    def _GetChangedUpdateAttrNames(self, row, origRow):
+        names = self.updateAttrNames
+        if self.updateChangedAttrNamesOnly:
+            rowAttrNames = row.attrNames + row.extraAttrNames
+            names = [n for n in self.updateAttrNames \
+                    if n not in rowAttrNames \
+                    or _AttributeChanged(row, origRow, n)] or names
+        if row.lazyLobAttrNames:
+            names = [n for n in names if row.GetLobProxy(n) is None] or names
+        return names
+
+    def _GetColumnarRows(self, *args):
+        """Return a columnar row store populated directly from the tuples
+           fetched from the database without building any row objects; the
+           extra attributes are set and the rows are sorted as they would be
+           by Row.GetRows()."""
+        rowClass = self.rowClass
+        conditions = dict(zip(self.retrievalAttrNames, args))
+        tableName, selectNames, queryConditions = \
+                rowClass.GetQueryInfo(**conditions)
+        orderBy = rowClass._GetDatabaseOrderBy(self.dataSource, selectNames)
+        if orderBy is not None:
+            queryConditions = dict(queryConditions, _orderBy = orderBy)
+        rows = self.dataSource.GetRows(tableName, selectNames, None,
+                **queryConditions)
+        store = ColumnarRowStore(rowClass)
+        store.AppendColumns(0, rowClass.ColumnsFromTuples(rows))
+        del rows
+        if rowClass.extraAttrNames:
+            rowClass.SetExtraAttributes(self.dataSource, store.values())
+        if rowClass.sortByAttrNames and orderBy is None:
+            store.Sort()
+        return store
+
+    def _GetDeletedPrimaryKeys(self, watermark):
+        if self.tombstoneTableName is None:
+            return []
+        attrName = self.tombstoneWatermarkAttrName or self.watermarkAttrName
+        conditions = { attrName + "__gte" : watermark }
+        return self.dataSource.GetRows(self.tombstoneTableName,
+                self.pkAttrNames, **conditions)
+
     def _GetNewRowHandle(self):
         if self.rows:
             handle = max(self.rows) + 1
@@ -302,8 +1156,21 @@ class DataSet(object, metaclass = DataSetMetaClass):
             return []
         conditions = dict(zip(self.retrievalAttrNames, args))
         self.retrievalArgs = args
+        if self.projectionAttrNames is not None \
+                and not self.useColumnarStorage:
+            conditions["_projection"] = self.projectionAttrNames
         return self.rowClass.GetRows(self.dataSource, **conditions)
 
+    def _IterRows(self, *args):
+        if self.tableName is None:
+            return iter([])
+        conditions = dict(zip(self.retrievalAttrNames, args))
+        self.retrievalArgs = args
+        if self.projectionAttrNames is not None \
+                and not self.useColumnarStorage:
+            conditions["_projection"] = self.projectionAttrNames
+        return self.rowClass.IterRows(self.dataSource, **conditions)
+
     def _InsertRowsInDatabase(self, transaction):
         for row in self.insertedRows.values():
             self.InsertRowInDatabase(transaction, row)
@@ -323,21 +1190,58 @@ class DataSet(object, metaclass = DataSetMetaClass):
     def _GetPrimaryKeyValues(self, transaction):
         if self.pkIsGenerated:
             attrName = self.pkAttrNames[0]
-            for row in self.insertedRows.values():
+            for handle, row in self.insertedRows.items():
                 item = transaction.itemsByRow.get(row)
                 if item is not None:
+                    self._RemoveRowFromIndexes(handle, row, attrName)
                     setattr(row, attrName, item.generatedKey)
+                    self._AddRowToIndexes(handle, row, attrName)
         for dataSet in self.childDataSets:
             dataSet._GetPrimaryKeyValues(transaction)
 
+    def _GetWatermark(self, rows, watermark = None):
+        for row in rows:
+            value = getattr(row, self.watermarkAttrName)
+            if value is not None and (watermark is None or value > watermark):
+                watermark = value
+        return watermark
+
+    def _GetSortKey(self, row, attrNames):
+        values = [getattr(row, n) for n in attrNames]
+        return tuple([(1, self._SortRep(v)) if v is not None else (0,) \
+                for v in values])
+
+    def _GetIndex(self, cls, attrNames):
+        for index in self.indexes:
+            if index.__class__ is cls and index.attrNames == attrNames:
+                return index
+
     def _PostUpdate(self):
         pass
 
     def _PreUpdate(self):
         pass
 
+    def _RebuildIndexes(self):
+        filterIndexes = []
+        for index in self.indexes:
+            if isinstance(index, FilterIndex):
+                filterIndexes.append(index)
+            else:
+                index.Build()
+        for index in filterIndexes:
+            index.Build()
+
+    def _RemoveRowFromIndexes(self, handle, row, attrName = None):
+        for index in self.indexes:
+            if attrName is None or attrName in index.attrNames:
+                index.RemoveRow(handle, row)
+
     def _SetRows(self, rows):
-        self.rows = dict(enumerate(rows))
+        if self.useColumnarStorage:
+            self.rows = ColumnarRowStore(self.rowClass, rows)
+        else:
+            self.rows = dict(enumerate(rows))
 
     def _SortRep(self, value):
         if isinstance(value, str):
@@ -361,6 +1265,29 @@ class DataSet(object, metaclass = DataSetMetaClass):
             row = self.rows[handle]
             self.UpdateRowInDatabase(transaction, row, origRow)
 
+    def AddHashIndex(self, *attrNames, unique = False):
+        """Add an index which maps the values of the given attributes to the
+           handles of the rows with those values and which is maintained as
+           rows are inserted, deleted and changed."""
+        for index in self.indexes:
+            if isinstance(index, HashIndex) and index.unique == unique \
+                    and index.attrNames == attrNames:
+                return index
+        index = HashIndex(self, attrNames, unique)
+        self.indexes.append(index)
+        return index
+
+    def AddSortedIndex(self, *attrNames):
+        """Add an index which keeps the handles of the rows sorted by the
+           given attributes as rows are inserted, deleted and changed, which
+           GetSortedRowHandles() will then use instead of sorting all of the
+           rows each time."""
+        index = self._GetIndex(SortedIndex, attrNames)
+        if index is None:
+            index = SortedIndex(self, attrNames)
+            self.indexes.append(index)
+        return index
+
     def AddChildDataSet(self, cls, contextItem = None):
         dataSet = cls(self.dataSource, contextItem)
         self.childDataSets.append(dataSet)
@@ -372,12 +1299,24 @@ class DataSet(object, metaclass = DataSetMetaClass):
     def CanInsertRow(self):
         return True
 
+    def CanRefreshIncrementally(self):
+        """Return true if Refresh() can merge the rows changed since the last
+           retrieval into the data set; otherwise, it retrieves the data set
+           again."""
+        return self.watermarkAttrName is not None \
+                and self.watermark is not None
+
     def Clear(self, includeChildren = True):
-        self.rows = {}
+        if self.useColumnarStorage:
+            self.rows = ColumnarRowStore(self.rowClass)
+        else:
+            self.rows = {}
         if includeChildren:
             for dataSet in self.childDataSets:
                 dataSet.Clear()
         self.ClearChanges(includeChildren = False)
+        self._RebuildIndexes()
+        self.watermark = None
 
     def ClearChanges(self, includeChildren = True):
         self.insertedRows = {}
@@ -390,6 +1329,7 @@ class DataSet(object, metaclass = DataSetMetaClass):
     def DeleteRow(self, handle):
         row = self.rows[handle]
         self._OnDeleteRow(row)
+        self._RemoveRowFromIndexes(handle, row)
         self.rows.pop(handle)
         if handle in self.insertedRows:
             self.insertedRows.pop(handle)
@@ -421,8 +1361,11 @@ class DataSet(object, metaclass = DataSetMetaClass):
         return [self.rows[h] for h in handles]
 
     def GetSortedRowHandles(self, *attrNames):
-        itemsToSort = [([self._SortRep(getattr(i, n)) for n in attrNames], h) \
-                for h, i in self.rows.items()]
+        index = self._GetIndex(SortedIndex, attrNames)
+        if index is not None:
+            return index.GetHandles()
+        itemsToSort = [(self._GetSortKey(r, attrNames), h) \
+                for h, r in self.rows.items()]
         itemsToSort.sort()
         return [i[1] for i in itemsToSort]
 
@@ -432,6 +1375,7 @@ class DataSet(object, metaclass = DataSetMetaClass):
             row = self.rowClass.New()
         self._OnInsertRow(row, choice)
         self.insertedRows[handle] = self.rows[handle] = row
+        self._AddRowToIndexes(handle, row)
         return handle, row
 
     def InsertRowInDatabase(self, transaction, row):
@@ -453,6 +1397,61 @@ class DataSet(object, metaclass = DataSetMetaClass):
     def OnCreate(self):
         pass
 
+    def PrefetchChildDataSets(self, cls, contextItems = None,
+            chunkSize = None):
+        """Create a child data set of the given class for each of the context
+           items (by default the rows of this data set) and retrieve all of
+           them at once using queries with an "in" condition on the retrieval
+           attribute, at most chunkSize values at a time; the rows are then
+           distributed to the child data sets by the value of that attribute.
+           Child data sets which cannot be retrieved in this fashion are
+           retrieved individually. The list of child data sets is returned."""
+        if contextItems is None:
+            contextItems = self.GetRows()
+        dataSets = [self.AddChildDataSet(cls, i) for i in contextItems]
+        if not dataSets:
+            return dataSets
+        canPrefetch = dataSets[0]._CanPrefetch()
+        if canPrefetch:
+            attrName, = cls.retrievalAttrNames
+            canPrefetch = all(hasattr(d.contextItem, attrName) \
+                    for d in dataSets)
+        prefetchDataSets = []
+        for dataSet in dataSets:
+            value = None
+            if canPrefetch:
+                dataSet.retrievalArgs = ()
+                value, = dataSet._GetArgsFromNames(cls.retrievalAttrNames)
+            if value is None:
+                dataSet.Retrieve()
+            else:
+                prefetchDataSets.append((value, dataSet))
+        if not prefetchDataSets:
+            return dataSets
+        if chunkSize is None:
+            chunkSize = getattr(self.dataSource, "maxInListSize", 1000)
+        values = list(dict.fromkeys(v for v, d in prefetchDataSets))
+        rowClass = dataSets[0].rowClass
+        isCharBoolean = attrName in rowClass.charBooleanAttrNames
+        rowsByValue = dict((v, []) for v in values)
+        for i in range(0, len(values), chunkSize):
+            conditions = { attrName + "__in" : values[i:i + chunkSize] }
+            rows = rowClass.GetRows(self.dataSource, **conditions)
+            for row in rows:
+                value = getattr(row, attrName)
+                if isCharBoolean:
+                    value = value and "Y" or "N"
+                rowsByValue[value].append(row)
+        for value, dataSet in prefetchDataSets:
+            dataSet.Clear()
+            dataSet.retrievalArgs = [value]
+            dataSet._SetRows(list(rowsByValue[value]))
+            dataSet._RebuildIndexes()
+            if dataSet.watermarkAttrName is not None:
+                dataSet.watermark = \
+                        dataSet._GetWatermark(dataSet.rows.values())
+        return dataSets
+
     def PendingChanges(self):
         if self.insertedRows or self.updatedRows or self.deletedRows:
             return True
@@ -462,41 +1461,192 @@ class DataSet(object, metaclass = DataSetMetaClass):
         return False
 
     def RevertChanges(self, includeChildren = True):
+        for handle in self.updatedRows:
+            self._RemoveRowFromIndexes(handle, self.rows[handle])
         while self.insertedRows:
             handle, row = self.insertedRows.popitem()
+            self._RemoveRowFromIndexes(handle, self.rows[handle])
             del self.rows[handle]
         while self.deletedRows:
             handle, row = self.deletedRows.popitem()
             self.rows[handle] = row
+            self._AddRowToIndexes(handle, row)
         while self.updatedRows:
             handle, row = self.updatedRows.popitem()
             self.rows[handle] = row
+            self._AddRowToIndexes(handle, row)
         if includeChildren:
             for dataSet in self.childDataSets:
                 dataSet.RevertChanges()
 
+    def Refresh(self):
+        """Merge the rows which have changed in the database since the data
+           set was last retrieved or refreshed into the data set, as
+           determined by the watermark attribute (such as a last modified
+           timestamp or a row version). Changed rows replace the existing rows
+           with the same primary key, retaining their handles; new rows are
+           added with new handles and rows whose primary keys are returned by
+           the tombstone table (if one is specified) are removed. Rows with
+           pending changes are left untouched. A tuple of the lists of added,
+           changed and removed handles is returned; if no watermark is
+           available, the data set is retrieved again instead and all of its
+           handles are returned as added. Rows fetched again (such as those
+           with the same watermark value as the last one seen) are not
+           reported as changed unless their values differ from the existing
+           rows; lazily read LOBs are not compared."""
+        if not self.CanRefreshIncrementally():
+            self.Retrieve(*self.retrievalArgs)
+            return list(self.rows.keys()), [], []
+        watermark = self.watermark
+        index = self.AddHashIndex(*self.pkAttrNames)
+        compareAttrNames = [n for n in self.rowClass.attrNames \
+                if n not in self.rowClass.lazyLobAttrNames]
+        pendingHandles = set(self.insertedRows)
+        pendingHandles.update(self.updatedRows)
+        deletedKeys = set(index._GetKey(r) for r in self.deletedRows.values())
+        addedHandles = []
+        changedHandles = []
+        removedHandles = []
+        rows = self._GetChangedRows(watermark)
+        for row in rows:
+            key = index._GetKey(row)
+            handle = index.FindHandle(*key)
+            if handle is None:
+                if key in deletedKeys:
+                    continue
+                handle = self._GetNewRowHandle()
+                addedHandles.append(handle)
+            elif handle in pendingHandles:
+                continue
+            else:
+                existingRow = self.rows[handle]
+                if not any(_AttributeChanged(row, existingRow, n) \
+                        for n in compareAttrNames):
+                    continue
+                self._RemoveRowFromIndexes(handle, existingRow)
+                changedHandles.append(handle)
+            self.rows[handle] = row
+            self._AddRowToIndexes(handle, row)
+        for key in self._GetDeletedPrimaryKeys(watermark):
+            handle = index.FindHandle(*key)
+            if handle is None or handle in pendingHandles:
+                continue
+            self._RemoveRowFromIndexes(handle, self.rows[handle])
+            self.rows.pop(handle)
+            removedHandles.append(handle)
+        self.watermark = self._GetWatermark(rows, watermark)
+        if removedHandles:
+            addedHandles = [h for h in addedHandles if h in self.rows]
+            changedHandles = [h for h in changedHandles if h in self.rows]
+        return addedHandles, changedHandles, removedHandles
+
     def Retrieve(self, *args):
         self.Clear()
         if self.retrievalAttrNames:
             self.retrievalArgs = args
             args = self._GetArgsFromNames(self.retrievalAttrNames)
         self.retrievalArgs = args
-        self._SetRows(self._GetRows(*args))
+        if self._CanRetrieveColumns():
+            self.rows = self._GetColumnarRows(*args)
+        else:
+            self._SetRows(self._GetRows(*args))
+        self._RebuildIndexes()
+        if self.watermarkAttrName is not None:
+            self.watermark = self._GetWatermark(self.rows.values())
+
+    def RetrieveAll(self, *args):
+        """Retrieve the data set and then all of its child data sets,
+           recursively. If the data source is thread safe, the child data
+           sets are retrieved in parallel, each in its own thread; once all of
+           the threads have completed, the first error encountered (in the
+           order of the child data sets) is raised."""
+        self.Retrieve(*args)
+        if not self.dataSource.threadSafe or len(self.childDataSets) < 2:
+            for dataSet in self.childDataSets:
+                dataSet.RetrieveAll()
+            return
+        threads = [cx_Threads.Thread(d.RetrieveAll) \
+                for d in self.childDataSets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for thread in threads:
+            if thread.errorObj is not None:
+                raise thread.errorObj
+
+    def RetrieveIncremental(self, *args, chunkSize = None):
+        """Retrieve the rows in chunks, adding each chunk to the rows of the
+           data set as it is fetched; this is a generator which yields the
+           list of handles added for each chunk."""
+        self.Clear()
+        if self.retrievalAttrNames:
+            self.retrievalArgs = args
+            args = self._GetArgsFromNames(self.retrievalAttrNames)
+        self.retrievalArgs = args
+        if chunkSize is None:
+            chunkSize = self.dataSource.arraySize
+        rows = self._IterRows(*args)
+        handle = 0
+        while True:
+            chunk = list(itertools.islice(rows, chunkSize))
+            if not chunk:
+                break
+            if self.insertedRows:
+                handle = max(handle, self._GetNewRowHandle())
+            self._AppendRows(handle, chunk)
+            if self.watermarkAttrName is not None:
+                self.watermark = self._GetWatermark(chunk, self.watermark)
+            yield list(range(handle, handle + len(chunk)))
+            handle += len(chunk)
+
+    def ToArrays(self, *attrNames):
+        """Return a dictionary of NumPy arrays, one for each of the given
+           attributes (or all attributes), containing the values of the rows
+           in the data set in the order of their handles. Null values are
+           masked and dates are returned as datetime64 values. If columnar
+           storage is used and rows have been neither deleted nor assigned,
+           the arrays are built directly from the stored columns."""
+        if not attrNames:
+            attrNames = self.rowClass.attrNames
+        rows = self.rows
+        if self.useColumnarStorage and not rows.assignedRows \
+                and all(len(rows.columns[n]) == len(rows) for n in attrNames):
+            columns = [rows.columns[n] for n in attrNames]
+        else:
+            values = [tuple(getattr(r, n) for n in attrNames) \
+                    for r in rows.values()]
+            columns = list(zip(*values)) if values else [()] * len(attrNames)
+        return _GetArrays(self.rowClass, attrNames, columns)
+
+    def SetProjection(self, *attrNames):
+        """Restrict the attributes fetched when the data set is retrieved to
+           the given ones (and the primary key); the other attributes are
+           fetched for each row when first accessed. Call with no arguments to
+           fetch all attributes again. Projections are not applied when
+           columnar storage is used."""
+        self.projectionAttrNames = attrNames or None
 
     def SetRows(self, rows):
         self._SetRows(rows)
         self.ClearChanges()
+        self._RebuildIndexes()
 
     def SetValue(self, handle, attrName, value):
         row = self.rows[handle]
         origValue = getattr(row, attrName)
         if value != origValue:
+            for index in self.indexes:
+                if attrName in index.attrNames:
+                    index.VerifyValue(handle, row, attrName, value)
             self.MarkAsChanged(handle)
             row = self.rows[handle]
             cx_Logging.Debug("setting attr %s on row %s to %r (from %r)",
                     attrName, handle, value, origValue)
             self._OnSetValue(row, attrName, value, origValue)
+            self._RemoveRowFromIndexes(handle, row, attrName)
             setattr(row, attrName, value)
+            self._AddRowToIndexes(handle, row, attrName)
 
     def Update(self):
         if not self.PendingChanges():
@@ -535,35 +1685,256 @@ class DataSet(object, metaclass = DataSetMetaClass):
         return transaction.ModifyRow(self, row, origRow)
 
 
+def _GetFilterPredicate(rawOperator, value):
+    """Return a function which returns a true value if the value passed to it
+       satisfies the condition identified by the operator (using the same
+       names as GetWhereClauseAndArgs) and value."""
+    if rawOperator is None or rawOperator == "eq":
+        if value is None:
+            return lambda v: v is None
+        return lambda v: v == value
+    elif rawOperator == "ne":
+        if value is None:
+            return lambda v: v is not None
+        return lambda v: v != value
+    elif rawOperator == "in":
+        values = set(value)
+        return lambda v: v in values
+    elif rawOperator == "lt":
+        return lambda v: v is not None and v < value
+    elif rawOperator == "lte":
+        return lambda v: v is not None and v <= value
+    elif rawOperator == "gt":
+        return lambda v: v is not None and v > value
+    elif rawOperator == "gte":
+        return lambda v: v is not None and v >= value
+    elif rawOperator == "contains":
+        return lambda v: v is not None and value in v
+    elif rawOperator == "startswith":
+        return lambda v: v is not None and v.startswith(value)
+    elif rawOperator == "endswith":
+        return lambda v: v is not None and v.endswith(value)
+    elif rawOperator == "icontains":
+        value = value.lower()
+        return lambda v: v is not None and value in v.lower()
+    elif rawOperator == "istartswith":
+        value = value.lower()
+        return lambda v: v is not None and v.lower().startswith(value)
+    elif rawOperator == "iendswith":
+        value = value.lower()
+        return lambda v: v is not None and v.lower().endswith(value)
+    raise ValueError("unsupported filter operator %r" % rawOperator)
+
+
+class FilterIndex(DataSetIndex):
+    """Index registered on the parent of a filtered data set which updates
+       the membership of the filtered data set as rows in the parent are
+       inserted, deleted and changed."""
+
+    def __init__(self, filteredDataSet):
+        self.filteredDataSet = filteredDataSet
+        self.dataSet = filteredDataSet.parentDataSet
+        self.Build()
+
+    @property
+    def attrNames(self):
+        attrNames = set(n for n, p in self.filteredDataSet.filterPredicates)
+        for index in self.filteredDataSet.indexes:
+            attrNames.update(index.attrNames)
+        return attrNames
+
+    def AddRow(self, handle, row):
+        self.filteredDataSet._OnParentRowAdded(handle, row)
+
+    def Build(self):
+        self.filteredDataSet._Refilter()
+
+    def Clear(self):
+        pass
+
+    def RemoveRow(self, handle, row):
+        self.filteredDataSet._OnParentRowRemoved(handle, row)
+
+
+class FilteredRows(object):
+    """Mapping of row handles to rows for filtered data sets which retains
+       only the handles of the member rows and returns the current row for
+       each of them from the parent data set."""
+
+    def __init__(self, parentDataSet, handles = ()):
+        self.parentDataSet = parentDataSet
+        self.handles = dict.fromkeys(handles)
+
+    def __contains__(self, handle):
+        return handle in self.handles
+
+    def __delitem__(self, handle):
+        del self.handles[handle]
+
+    def __getitem__(self, handle):
+        if handle not in self.handles:
+            raise KeyError(handle)
+        return self.parentDataSet.rows[handle]
+
+    def __iter__(self):
+        return iter(self.handles)
+
+    def __len__(self):
+        return len(self.handles)
+
+    def __setitem__(self, handle, row):
+        self.handles[handle] = None
+
+    def clear(self):
+        self.handles.clear()
+
+    def get(self, handle, defaultValue = None):
+        if handle in self.handles:
+            return self.parentDataSet.rows[handle]
+        return defaultValue
+
+    def items(self):
+        rows = self.parentDataSet.rows
+        return [(h, rows[h]) for h in self.handles]
+
+    def keys(self):
+        return list(self.handles)
+
+    def pop(self, handle, *args):
+        if handle not in self.handles:
+            if args:
+                return args[0]
+            raise KeyError(handle)
+        row = self.parentDataSet.rows[handle]
+        del self.handles[handle]
+        return row
+
+    def values(self):
+        rows = self.parentDataSet.rows
+        return [rows[h] for h in self.handles]
+
+
 class FilteredDataSet(DataSet):
+    """Data set containing a subset of the rows of a parent data set. The
+       subset is either determined by the _GetRows() method when the data set
+       is retrieved or, if SetFilter() has been called (or the class attribute
+       filterConditions is set), by a set of conditions which are evaluated
+       as rows in the parent are inserted, deleted and changed."""
+    filterConditions = None
+    filterIndex = None
 
     def __init__(self, parentDataSet):
         super(FilteredDataSet, self).__init__(parentDataSet.dataSource)
         self.parentDataSet = parentDataSet
+        if self.filterConditions is not None:
+            self.SetFilter(**self.filterConditions)
+
+    def _GetCandidateHandles(self):
+        eqValues = dict((n, v) for n, o, v in self.filterConditionTuples \
+                if o is None or o == "eq")
+        for index in self.parentDataSet.indexes:
+            if isinstance(index, HashIndex) \
+                    and all(n in eqValues for n in index.attrNames):
+                key = tuple([eqValues[n] for n in index.attrNames])
+                if not index.unique or None not in key:
+                    return index.FindHandles(*key)
+        return self.parentDataSet.rows.keys()
+
+    def _MatchesFilter(self, row):
+        for attrName, predicate in self.filterPredicates:
+            if not predicate(getattr(row, attrName)):
+                return False
+        return True
+
+    def _OnParentRowAdded(self, handle, row):
+        if handle in self.insertedRows or self._MatchesFilter(row):
+            self.rows[handle] = row
+            self._AddRowToIndexes(handle, row)
+
+    def _OnParentRowRemoved(self, handle, row):
+        if handle in self.rows:
+            self._RemoveRowFromIndexes(handle, row)
+            del self.rows[handle]
+
+    def _Refilter(self):
+        parentRows = self.parentDataSet.rows
+        handles = [h for h in self.insertedRows if h in parentRows]
+        for handle in self._GetCandidateHandles():
+            if handle not in self.insertedRows \
+                    and self._MatchesFilter(parentRows[handle]):
+                handles.append(handle)
+        self.rows = FilteredRows(self.parentDataSet, handles)
+        self._RebuildIndexes()
 
     def _SetRows(self, rows):
         handlesByRow = dict((r, h) \
                 for h, r in self.parentDataSet.rows.items())
         self.rows = dict((handlesByRow[r], r) for r in rows)
 
+    def Clear(self, includeChildren = True):
+        if self.filterIndex is None:
+            super(FilteredDataSet, self).Clear(includeChildren)
+        else:
+            self.ClearChanges(includeChildren = False)
+            self._Refilter()
+
     def DeleteRow(self, handle):
-        super(FilteredDataSet, self).DeleteRow(handle)
+        if self.filterIndex is None:
+            super(FilteredDataSet, self).DeleteRow(handle)
         self.parentDataSet.DeleteRow(handle)
+        self.insertedRows.pop(handle, None)
 
     def InsertRow(self, choice = None, row = None):
         handle, parentRow = self.parentDataSet.InsertRow(choice, row)
-        self.insertedRows[handle] = self.rows[handle] = parentRow
+        self.insertedRows[handle] = parentRow
+        if handle not in self.rows:
+            self.rows[handle] = parentRow
+            self._AddRowToIndexes(handle, parentRow)
         return handle, parentRow
 
     def PendingChanges(self):
         return self.parentDataSet.PendingChanges()
 
     def Retrieve(self, *args):
-        allRows = self.parentDataSet.GetRows()
-        super(FilteredDataSet, self).Retrieve(allRows, *args)
+        if self.filterIndex is not None:
+            self.Clear()
+        else:
+            allRows = self.parentDataSet.GetRows()
+            super(FilteredDataSet, self).Retrieve(allRows, *args)
+
+    def RevertChanges(self, includeChildren = True):
+        if self.filterIndex is None:
+            super(FilteredDataSet, self).RevertChanges(includeChildren)
+        else:
+            self.parentDataSet.RevertChanges(includeChildren)
+            self.ClearChanges(includeChildren = False)
+
+    def SetFilter(self, **conditions):
+        """Set the conditions which determine the rows of the parent data set
+           which are members of this data set. The conditions are specified in
+           the same way as for GetWhereClauseAndArgs(); membership is
+           maintained incrementally from then on and equality conditions use
+           any hash index on the parent data set."""
+        self.filterConditionTuples = []
+        self.filterPredicates = []
+        for name, value in conditions.items():
+            pos = name.find("__")
+            if pos < 0:
+                attrName, rawOperator = name, None
+            else:
+                attrName, rawOperator = name[:pos], name[pos + 2:]
+            predicate = _GetFilterPredicate(rawOperator, value)
+            self.filterConditionTuples.append((attrName, rawOperator, value))
+            self.filterPredicates.append((attrName, predicate))
+        if self.filterIndex is None:
+            self.filterIndex = FilterIndex(self)
+            self.parentDataSet.indexes.append(self.filterIndex)
+        else:
+            self._Refilter()
 
     def SetValue(self, handle, attrName, value):
-        super(FilteredDataSet, self).SetValue(handle, attrName, value)
+        if self.filterIndex is None:
+            super(FilteredDataSet, self).SetValue(handle, attrName, value)
         self.parentDataSet.SetValue(handle, attrName, value)
 
     def Update(self):
@@ -572,23 +1943,25 @@ class FilteredDataSet(DataSet):
 
 
 class KeyedDataSet(object):
+    """Provides access to the rows of a data set by key, using a hash index on
+       the data set which is kept up to date as rows are inserted, deleted
+       and changed."""
 
     def __init__(self, dataSet, *attrNames):
         self.dataSet = dataSet
-        self.rows = {}
-        for handle, row in dataSet.rows.items():
-            key = tuple([getattr(row, n) for n in attrNames])
-            self.rows[key] = handle
+        self.index = dataSet.AddHashIndex(*attrNames)
+
+    @property
+    def rows(self):
+        return dict((k, h[0]) for k, h in self.index.handles.items())
 
     def DeleteRow(self, *key):
-        try:
-            handle = self.rows.pop(key)
-        except KeyError:
-            return
-        self.dataSet.DeleteRow(handle)
+        handle = self.index.FindHandle(*key)
+        if handle is not None:
+            self.dataSet.DeleteRow(handle)
 
     def FindRow(self, *key):
-        handle = self.rows.get(key)
+        handle = self.index.FindHandle(*key)
         if handle is not None:
             return RowForUpdate(self.dataSet, handle)
 
@@ -618,3 +1991,6 @@ class RowForUpdate(object):
     def Delete(self):
         self._dataSet.DeleteRow(self._handle)
 
+
+class NumPyNotAvailable(cx_Exceptions.BaseException):
+    message = "NumPy is required but is not installed."
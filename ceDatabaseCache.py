@@ -3,8 +3,14 @@ Define classes and methods used for caching database results.
 """
 
 import ceDatabase
+import collections
+import copy
 import cx_Exceptions
 import cx_Logging
+import cx_Threads
+import sys
+import threading
+import time
 
 class PathMetaClass(type):
 
@@ -28,11 +34,17 @@ class Path(object, metaclass = PathMetaClass):
     stringRetrievalAttrNames = []
     subCacheAttrName = None
     cacheAttrName = None
+    batchCacheAttrName = None
     ignoreRowNotCached = False
+    cacheMisses = False
+    missTimeToLive = None
+    maxMisses = 10000
     name = None
 
     def __init__(self, cache, subCache):
         self.rows = {}
+        self.loadTimes = {}
+        self.misses = {}
         self.subCacheName = subCache.name
         self.rowClass = subCache.rowClass
         self.Clear()
@@ -51,13 +63,84 @@ class Path(object, metaclass = PathMetaClass):
 
     def _CacheValue(self, args, value):
         if len(args) == 1:
-            self.rows[args[0]] = value
+            key, = args
         elif len(args) > 1:
-            self.rows[args] = value
+            key = args
+        else:
+            return value
+        self.rows[key] = value
+        self.loadTimes[key] = time.monotonic()
+        if self.misses:
+            self.misses.pop(key, None)
         return value
 
+    def _CacheMiss(self, args):
+        if self.cacheMisses:
+            key = args[0] if len(args) == 1 else args
+            self.misses.pop(key, None)
+            self.misses[key] = time.monotonic()
+            if self.maxMisses is not None:
+                while len(self.misses) > self.maxMisses:
+                    del self.misses[next(iter(self.misses))]
+
+    def _IsMissCached(self, args):
+        key = args[0] if len(args) == 1 else args
+        missTime = self.misses.get(key)
+        if missTime is None:
+            return False
+        if self.missTimeToLive is not None \
+                and time.monotonic() - missTime > self.missTimeToLive:
+            self.misses.pop(key, None)
+            return False
+        return True
+
+    def _CanLoadForKeys(self):
+        """Return true if the values for many keys can be loaded with a
+           single query. This is not the case if the path has more than one
+           retrieval attribute or if the methods used for loading a single
+           key have been overridden but not the ones used for many keys."""
+        cls = self.__class__
+        if len(cls.retrievalAttrNames) != 1 or cls.Load is not Path.Load:
+            return False
+        if cls.GetRowsFromDataSource is not Path.GetRowsFromDataSource \
+                and cls.GetRowsForKeysFromDataSource \
+                        is Path.GetRowsForKeysFromDataSource:
+            return False
+        if cls._OnLoad in (SingleRowPath._OnLoad, MultipleRowPath._OnLoad):
+            return True
+        return cls._OnLoadForKey not in (SingleRowPath._OnLoadForKey,
+                MultipleRowPath._OnLoadForKey)
+
+    def _GetCacheKeyValue(self, row):
+        args = []
+        for attrName in self.retrievalAttrNames:
+            value = getattr(row, attrName)
+            if attrName in self.stringRetrievalAttrNames \
+                    and value is not None:
+                value = value.upper()
+            args.append(value)
+        if len(args) == 1:
+            return args[0]
+        return tuple(args)
+
     def Clear(self):
         self.rows.clear()
+        self.loadTimes.clear()
+        self.misses.clear()
+
+    def ClearMiss(self, row):
+        if self.misses:
+            self.misses.pop(self._GetCacheKeyValue(row), None)
+
+    def EvictEmptyValue(self, args):
+        key = args[0] if len(args) == 1 else args
+        value = self.rows.get(key)
+        if value is not None and not value:
+            del self.rows[key]
+            self.loadTimes.pop(key, None)
+
+    def EvictRow(self, row):
+        pass
 
     def GetCachedValue(self, args):
         if len(args) == 1:
@@ -81,22 +164,45 @@ class Path(object, metaclass = PathMetaClass):
         conditions = dict(zip(self.retrievalAttrNames, args))
         return self.rowClass.GetRows(cache.dataSource, **conditions)
 
+    def GetRowsForKeysFromDataSource(self, cache, keys):
+        attrName, = self.retrievalAttrNames
+        conditions = { attrName + "__in" : keys }
+        return self.rowClass.GetRows(cache.dataSource, **conditions)
+
     def Load(self, cache, subCache, *args):
+        if self.misses and self._IsMissCached(args):
+            raise cx_Exceptions.NoDataFound()
         rows = self.GetRowsFromDataSource(cache, *args)
-        cachedValue = self._OnLoad(rows, *args)
+        with subCache.lock:
+            cachedValue = self._OnLoad(rows, *args)
+            subCache._AddEmptyValueToLru(self, args, cachedValue)
+            subCache._CompletePendingLoad(self, args, cachedValue)
         subCache.OnLoadRows(cache, rows)
         return cachedValue
 
 
 class SingleRowPath(Path):
 
+    def _OnLoadForKey(self, key, rows):
+        if not rows:
+            self._CacheMiss((key,))
+            return None
+        return self._OnLoad(rows, key)
+
     def _OnLoad(self, rows, *args):
         if len(rows) == 0:
+            self._CacheMiss(args)
             raise cx_Exceptions.NoDataFound()
         elif len(rows) > 1:
             raise cx_Exceptions.TooManyRows(numRows = len(rows))
         return self._CacheValue(args, rows[0])
 
+    def EvictRow(self, row):
+        key = self._GetCacheKeyValue(row)
+        if self.rows.get(key) is row:
+            del self.rows[key]
+            self.loadTimes.pop(key, None)
+
     def OnRowNotCached(self, args):
         return None
 
@@ -107,10 +213,47 @@ class MultipleRowPath(Path):
     def _OnLoad(self, rows, *args):
         return self._CacheValue(args, rows)
 
+    def _OnLoadForKey(self, key, rows):
+        return self._CacheValue((key,), rows)
+
+    def EvictRow(self, row):
+        key = self._GetCacheKeyValue(row)
+        rows = self.rows.get(key)
+        if rows is not None and row in rows:
+            del self.rows[key]
+            self.loadTimes.pop(key, None)
+
     def OnRowNotCached(self, args):
         return list()
 
 
+class PendingLoad(object):
+    """Load of a cached value in progress in one thread, which other threads
+       requiring the same value wait for instead of loading it themselves."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = self.error = None
+
+    def SetError(self, error):
+        self.error = error
+        self.event.set()
+
+    def SetValue(self, value):
+        self.value = value
+        self.event.set()
+
+    def Wait(self):
+        self.event.wait()
+        if self.error is None:
+            return self.value
+        try:
+            error = copy.copy(self.error)
+        except Exception:
+            raise self.error
+        raise error from self.error
+
+
 class SubCacheMetaClass(type):
 
     def __init__(cls, name, bases, classDict):
@@ -136,8 +279,10 @@ class SubCacheMetaClass(type):
             cls.name = cls.__name__
         if cls.regenerateMethods \
                 or not hasattr(cls, cls.onLoadRowMethodName) \
+                or not hasattr(cls, cls.addRowMethodName) \
                 or not hasattr(cls, cls.onRemoveRowMethodName):
             onLoadRowMethodLines = []
+            addRowMethodLines = []
             onRemoveRowMethodLines = []
             for directive in cls.onLoadRowExtraDirectives:
                 line = "row.%s = cache.%s(row.%s)" % directive
@@ -151,16 +296,19 @@ class SubCacheMetaClass(type):
                 if issubclass(pathClass, SingleRowPath):
                     line = "self.%s[%s] = row" % \
                             (pathClass.subCacheAttrName, keyArgs)
-                    onLoadRowMethodLines.append(line)
-                    line = "del self.%s[%s]" % \
+                    addRowMethodLines.append(line)
+                    line = "self.%s.pop(%s, None)" % \
                             (pathClass.subCacheAttrName, keyArgs)
                     onRemoveRowMethodLines.append(line)
                 else:
                     if cls.loadAllRowsOnFirstLoad:
                         line = "self.%s.setdefault(%s, []).append(row)" % \
                                 (pathClass.subCacheAttrName, keyArgs)
-                        onLoadRowMethodLines.append(line)
-                    line = "self.%s[%s].remove(row)" % \
+                        addRowMethodLines.append(line)
+                    line = "if row in self.%s.get(%s, ()):" % \
+                            (pathClass.subCacheAttrName, keyArgs)
+                    onRemoveRowMethodLines.append(line)
+                    line = "    self.%s[%s].remove(row)" % \
                             (pathClass.subCacheAttrName, keyArgs)
                     onRemoveRowMethodLines.append(line)
             if onLoadRowMethodLines:
@@ -168,6 +316,11 @@ class SubCacheMetaClass(type):
                         or not hasattr(cls, cls.onLoadRowMethodName):
                     cls._GenerateMethod(cls, cls.onLoadRowMethodName,
                             onLoadRowMethodLines, "cache", "row")
+            if addRowMethodLines:
+                if cls.regenerateMethods \
+                        or not hasattr(cls, cls.addRowMethodName):
+                    cls._GenerateMethod(cls, cls.addRowMethodName,
+                            addRowMethodLines, "row")
             if onRemoveRowMethodLines:
                 if cls.regenerateMethods \
                         or not hasattr(cls, cls.onRemoveRowMethodName):
@@ -179,10 +332,16 @@ class SubCache(object, metaclass = SubCacheMetaClass):
     setExtraAttrValuesMethodName = "SetExtraAttrValues"
     onRemoveRowMethodName = "OnRemoveRow"
     onLoadRowMethodName = "OnLoadRow"
+    addRowMethodName = "AddRowToPaths"
     regenerateMethods = False
     onLoadRowExtraDirectives = []
     loadAllRowsOnFirstLoad = False
     allRowsMethodCacheAttrName = None
+    maxRows = None
+    maxBytes = None
+    timeToLive = None
+    refreshAheadTime = None
+    threadSafe = False
     pathClasses = []
     pathClassesByName = {}
     cacheAttrName = None
@@ -195,11 +354,24 @@ class SubCache(object, metaclass = SubCacheMetaClass):
         self.pathsByName = {}
         self.allRowsLoaded = False
         self.allRows = []
+        self.allRowsLoadTime = None
+        self.lruRows = collections.OrderedDict()
+        self.numBytes = 0
+        self.pendingRefreshes = set()
+        self.refreshLock = threading.Lock()
+        self.lock = threading.RLock()
+        self.loadAllRowsLock = threading.Lock()
+        self.pendingLoads = {}
+        self.missPaths = []
         for cls in self.pathClasses:
             path = cls(cache, self)
             self.paths.append(path)
             self.pathsByName[path.name] = path
             setattr(self, cls.subCacheAttrName, path.rows)
+            setattr(self, cls.subCacheAttrName + "LoadTimes", path.loadTimes)
+            setattr(self, cls.subCacheAttrName + "Misses", path.misses)
+            if cls.cacheMisses:
+                self.missPaths.append(path)
             if issubclass(cls, SingleRowPath):
                 self.singleRowPaths.append(path)
 
@@ -211,12 +383,25 @@ class SubCache(object, metaclass = SubCacheMetaClass):
         cx_Logging.Debug("%s: GENERATED CODE\n%s", cls.name, codeString)
         code = compile(codeString, "SubCacheGeneratedCode.py", "exec")
         temp = {}
-        exec(code, dict(), temp)
+        exec(code, dict(cx_Exceptions = cx_Exceptions, time = time), temp)
         setattr(targetClass, methodName, temp[methodName])
 
     @classmethod
     def _GenerateCacheMethods(cls, cacheClass):
-        if cls.allRowsMethodCacheAttrName is not None:
+        if cls.allRowsMethodCacheAttrName is not None \
+                and cls.timeToLive is not None:
+            ref = "self.%s" % cls.cacheAttrName
+            methodLines = [
+                    "if %s.allRowsLoaded:" % ref,
+                    "    if time.monotonic() - %s.allRowsLoadTime <= %r:" % \
+                            (ref, cls.timeToLive),
+                    "        return %s.allRows" % ref,
+                    "    %s.Clear()" % ref,
+                    "return %s.LoadAllRows(self)" % ref
+            ]
+            cls._GenerateMethod(cacheClass, cls.allRowsMethodCacheAttrName,
+                    methodLines)
+        elif cls.allRowsMethodCacheAttrName is not None:
             methodLines = [
                     "if self.%s.allRowsLoaded:" % cls.cacheAttrName,
                     "    return self.%s.allRows" % cls.cacheAttrName,
@@ -229,16 +414,101 @@ class SubCache(object, metaclass = SubCacheMetaClass):
                 continue
             processedArgs, keyArgs = pathClass._GetProcessedAndKeyArgs()
             ref = "self.%s" % cls.cacheAttrName
+            args = ", ".join(processedArgs)
+            isTimed = cls._IsTimed()
+            loadLines = []
+            if pathClass.cacheMisses:
+                loadLines.append("    missTime = %s.%sMisses.get(%s)" % \
+                        (ref, pathClass.subCacheAttrName, keyArgs))
+                condition = "missTime is not None"
+                if pathClass.missTimeToLive is not None:
+                    condition += " and time.monotonic() - missTime <= %r" % \
+                            pathClass.missTimeToLive
+                loadLines.extend([
+                        "    if %s:" % condition,
+                        "        raise cx_Exceptions.NoDataFound()"
+                ])
+            loadLines.append("    return %s.Load(self, %r, %s)" % \
+                    (ref, pathClass.name, args))
+            if not cls._HasLimits() and not isTimed:
+                methodLines = [
+                        "try:",
+                        "    return %s.%s[%s]" % \
+                                (ref, pathClass.subCacheAttrName, keyArgs),
+                        "except KeyError:"
+                ] + loadLines
+                cls._GenerateMethod(cacheClass, pathClass.cacheAttrName,
+                        methodLines, *pathClass.retrievalAttrNames)
+                continue
             methodLines = [
                     "try:",
-                    "    return %s.%s[%s]" % \
-                            (ref, pathClass.subCacheAttrName, keyArgs),
-                    "except KeyError:",
-                    "    return %s.Load(self, %r, %s)" % \
-                            (ref, pathClass.name, ", ".join(processedArgs))
+                    "    value = %s.%s[%s]" % \
+                            (ref, pathClass.subCacheAttrName, keyArgs)
             ]
+            if isTimed:
+                methodLines.append("    age = time.monotonic() - " \
+                        "%s.%sLoadTimes[%s]" % \
+                        (ref, pathClass.subCacheAttrName, keyArgs))
+            if cls._HasLimits():
+                if issubclass(pathClass, SingleRowPath):
+                    methodLines.append("    %s.lruRows.move_to_end(value)" % \
+                            ref)
+                else:
+                    methodLines.extend([
+                            "    touch = %s.lruRows.move_to_end" % ref,
+                            "    for row in value:",
+                            "        touch(row)"
+                    ])
+            methodLines.append("except KeyError:")
+            methodLines.extend(loadLines)
+            if cls.timeToLive is not None:
+                methodLines.extend([
+                        "if age > %r:" % cls.timeToLive,
+                        "    return %s.Reload(self, %r, %s)" % \
+                                (ref, pathClass.name, args)
+                ])
+            if cls.refreshAheadTime is not None \
+                    and not cls.loadAllRowsOnFirstLoad:
+                methodLines.extend([
+                        "if age > %r:" % cls.refreshAheadTime,
+                        "    %s.RefreshAhead(self, %r, %s)" % \
+                                (ref, pathClass.name, args)
+                ])
+            methodLines.append("return value")
             cls._GenerateMethod(cacheClass, pathClass.cacheAttrName,
                     methodLines, *pathClass.retrievalAttrNames)
+        for pathClass in cls.pathClasses:
+            if pathClass.batchCacheAttrName is None:
+                continue
+            ref = "self.%s" % cls.cacheAttrName
+            loadLine = "return %s.LoadMany(self, %r, keys)" % \
+                    (ref, pathClass.name)
+            if cls._HasLimits() or cls._IsTimed() \
+                    or len(pathClass.retrievalAttrNames) != 1:
+                methodLines = [loadLine]
+            else:
+                if pathClass.retrievalAttrNames[0] \
+                        in pathClass.stringRetrievalAttrNames:
+                    keyArgs = "key.upper() if isinstance(key, str) else key"
+                else:
+                    keyArgs = "key"
+                methodLines = [
+                        "rows = %s.%s" % (ref, pathClass.subCacheAttrName),
+                        "try:",
+                        "    return [rows[%s] for key in keys]" % keyArgs,
+                        "except KeyError:",
+                        "    " + loadLine
+                ]
+            cls._GenerateMethod(cacheClass, pathClass.batchCacheAttrName,
+                    methodLines, "keys")
+
+    def _CompletePendingLoad(self, path, args, value = None, error = None):
+        pendingLoad = self.pendingLoads.pop((path.name, args), None)
+        if pendingLoad is not None:
+            if error is not None:
+                pendingLoad.SetError(error)
+            else:
+                pendingLoad.SetValue(value)
 
     def _CopyAttrs(self, row, externalRow, contextItem):
         for attrName in row.attrNames + row.extraAttrNames:
@@ -250,6 +520,177 @@ class SubCache(object, metaclass = SubCacheMetaClass):
                 continue
             setattr(row, attrName, value)
 
+    def _AddEmptyValueToLru(self, path, args, value):
+        if value or not isinstance(value, list) or not self._HasLimits():
+            return
+        entry = (path.name, args)
+        if entry in self.lruRows:
+            self.lruRows.move_to_end(entry)
+            return
+        size = sys.getsizeof(value) if self.maxBytes is not None else 0
+        self.lruRows[entry] = size
+        self.numBytes += size
+
+    def _AddRowToLru(self, row):
+        if row in self.lruRows:
+            self.lruRows.move_to_end(row)
+            return
+        size = self._GetRowSize(row) if self.maxBytes is not None else 0
+        self.lruRows[row] = size
+        self.numBytes += size
+
+    def _EvictRow(self, row):
+        self._RemoveRowFromLru(row)
+        for path in self.paths:
+            path.EvictRow(row)
+
+    def _EvictRows(self, loadedRows = ()):
+        while self.lruRows and (self.maxRows is not None \
+                        and len(self.lruRows) > self.maxRows \
+                or self.maxBytes is not None \
+                        and self.numBytes > self.maxBytes):
+            entry = next(iter(self.lruRows))
+            if entry in loadedRows:
+                break
+            size = self.lruRows.pop(entry)
+            self.numBytes -= size
+            if isinstance(entry, tuple):
+                pathName, args = entry
+                self.pathsByName[pathName].EvictEmptyValue(args)
+            else:
+                for path in self.paths:
+                    path.EvictRow(entry)
+
+    def _GetRowSize(self, row):
+        """Return the approximate number of bytes used by the row; lazily read
+           LOBs which have not been read yet are not read."""
+        size = sys.getsizeof(row)
+        for attrName in row.attrNames + row.extraAttrNames:
+            if attrName in row.lazyLobAttrNames:
+                attrName = "_" + attrName
+            size += sys.getsizeof(getattr(row, attrName, None))
+        return size
+
+    @classmethod
+    def _HasLimits(cls):
+        """Return true if the number of rows or bytes cached is limited, in
+           which case the least recently used rows are evicted when the limit
+           is exceeded. Limits are not applied when all rows are loaded on the
+           first load."""
+        return not cls.loadAllRowsOnFirstLoad \
+                and (cls.maxRows is not None or cls.maxBytes is not None)
+
+    @classmethod
+    def _IsTimed(cls):
+        """Return true if the time at which values are loaded is checked by
+           the cache methods, in order to expire them or refresh them ahead
+           of expiry."""
+        return cls.timeToLive is not None or cls.refreshAheadTime is not None
+
+    def _LoadAllRows(self, cache):
+        if self.tracePathLoads:
+            cx_Logging.Debug("%s: loading all rows", self.name)
+        rows = self.GetAllRowsFromDataSource(cache)
+        self.OnLoadRows(cache, rows)
+        with self.lock:
+            self.allRows = rows
+            self.allRowsLoaded = True
+            self.allRowsLoadTime = time.monotonic()
+        return rows
+
+    def _LoadMissingKeys(self, cache, path, missingArgs, values):
+        keys = [a[0] for a in missingArgs]
+        chunkSize = getattr(cache.dataSource, "maxInListSize", 1000)
+        loadedRows = []
+        rowsByKey = dict((k, []) for k in keys)
+        for i in range(0, len(keys), chunkSize):
+            rows = path.GetRowsForKeysFromDataSource(cache,
+                    keys[i:i + chunkSize])
+            for row in rows:
+                keyRows = rowsByKey.get(path._GetCacheKeyValue(row))
+                if keyRows is not None:
+                    keyRows.append(row)
+            loadedRows.extend(rows)
+        with self.lock:
+            for args, key in zip(missingArgs, keys):
+                values[args] = path._OnLoadForKey(key, rowsByKey[key])
+                self._AddEmptyValueToLru(path, args, values[args])
+        self.OnLoadRows(cache, loadedRows)
+
+    def _LoadSingleFlight(self, cache, path, args):
+        """Load the value for the path unless another thread is already
+           loading it, in which case wait for that load to place the value
+           in the cache and return it (or raise its exception) instead, so that
+           concurrent misses on the same key result in only one query."""
+        loadKey = (path.name, args)
+        key = args[0] if len(args) == 1 else args
+        with self.lock:
+            value = path.rows.get(key)
+            if value is not None:
+                return value
+            pendingLoad = self.pendingLoads.get(loadKey)
+            isLoader = pendingLoad is None
+            if isLoader:
+                pendingLoad = self.pendingLoads[loadKey] = PendingLoad()
+        if not isLoader:
+            return pendingLoad.Wait()
+        value = error = None
+        try:
+            value = path.Load(cache, self, *args)
+        except Exception as e:
+            error = e
+            raise
+        except BaseException:
+            error = LoadInterrupted()
+            raise
+        finally:
+            with self.lock:
+                self._CompletePendingLoad(path, args, value, error)
+        return value
+
+    def _Refresh(self, cache, pathName, args):
+        try:
+            path = self.pathsByName[pathName]
+            key = args[0] if len(args) == 1 else args
+            rows = path.GetRowsFromDataSource(cache, *args)
+            with self.lock:
+                oldValue = path.rows.get(key)
+                if isinstance(path, SingleRowPath) and len(rows) != 1:
+                    if oldValue is not None:
+                        self._EvictRow(oldValue)
+                    return
+                value = path._OnLoad(rows, *args)
+                self._AddEmptyValueToLru(path, args, value)
+                if isinstance(path, SingleRowPath):
+                    oldRows = [oldValue] if oldValue is not None else []
+                else:
+                    oldRows = oldValue or []
+                for row in oldRows:
+                    if row not in rows:
+                        self._EvictRow(row)
+            self.OnLoadRows(cache, rows)
+        finally:
+            with self.refreshLock:
+                self.pendingRefreshes.discard((pathName, args))
+
+    def _RemoveRowFromLru(self, row):
+        size = self.lruRows.pop(row, None)
+        if size is not None:
+            self.numBytes -= size
+
+    def _SetLoadTimes(self, rows):
+        loadTime = time.monotonic()
+        for path in self.paths:
+            isSingleRowPath = isinstance(path, SingleRowPath)
+            for row in rows:
+                key = path._GetCacheKeyValue(row)
+                if key not in path.rows:
+                    continue
+                if isSingleRowPath:
+                    path.loadTimes[key] = loadTime
+                else:
+                    path.loadTimes.setdefault(key, loadTime)
+
     def _FindRow(self, externalRow, errorIfMissing = False):
         row = None
         for path in self.singleRowPaths:
@@ -264,10 +705,14 @@ class SubCache(object, metaclass = SubCacheMetaClass):
         return row
 
     def Clear(self):
-        self.allRows = []
-        self.allRowsLoaded = False
-        for path in self.paths:
-            path.Clear()
+        with self.lock:
+            self.allRows = []
+            self.allRowsLoaded = False
+            self.allRowsLoadTime = None
+            self.lruRows.clear()
+            self.numBytes = 0
+            for path in self.paths:
+                path.Clear()
 
     def GetAllRowsFromDataSource(self, cache):
         return self.rowClass.GetRows(cache.dataSource)
@@ -287,56 +732,200 @@ class SubCache(object, metaclass = SubCacheMetaClass):
             if not self.allRowsLoaded:
                 self.LoadAllRows(cache)
             return path.GetCachedValue(actualArgs)
+        if self.threadSafe:
+            return self._LoadSingleFlight(cache, path, actualArgs)
         return path.Load(cache, self, *actualArgs)
 
     def LoadAllRows(self, cache):
-        if self.tracePathLoads:
-            cx_Logging.Debug("%s: loading all rows", self.name)
-        rows = self.GetAllRowsFromDataSource(cache)
-        self.OnLoadRows(cache, rows)
-        self.allRows = rows
-        self.allRowsLoaded = True
-        return self.allRows
+        if not self.threadSafe:
+            return self._LoadAllRows(cache)
+        with self.loadAllRowsLock:
+            if self.allRowsLoaded:
+                return self.allRows
+            return self._LoadAllRows(cache)
+
+    def LoadMany(self, cache, pathName, keys):
+        """Return the cached values for each of the keys (a value for paths
+           with a single retrieval attribute or a tuple of values otherwise),
+           in the same order as the keys. The values which are not cached are
+           loaded with as few queries as possible (in chunks of no more than
+           the maximum size of an in list supported by the data source) and
+           are then added to all of the paths. None is returned in place of
+           any single row which does not exist."""
+        path = self.pathsByName[pathName]
+        isSingleRowPath = isinstance(path, SingleRowPath)
+        argsList = []
+        for key in keys:
+            if len(path.retrievalAttrNames) == 1:
+                key = (key,)
+            args = []
+            for attrName, value in zip(path.retrievalAttrNames, key):
+                if isinstance(value, ceDatabase.Row):
+                    value = getattr(value, attrName)
+                if attrName in path.stringRetrievalAttrNames \
+                        and value is not None:
+                    value = value.upper()
+                args.append(value)
+            argsList.append(tuple(args))
+        if self.loadAllRowsOnFirstLoad:
+            if not self.allRowsLoaded:
+                self.LoadAllRows(cache)
+            results = []
+            for args in argsList:
+                try:
+                    results.append(path.GetCachedValue(args))
+                except cx_Exceptions.NoDataFound:
+                    results.append(None)
+            return results
+        values = {}
+        missingArgs = []
+        now = time.monotonic()
+        with self.lock:
+            for args in dict.fromkeys(argsList):
+                key = args[0] if len(args) == 1 else args
+                value = path.rows.get(key)
+                loadTime = path.loadTimes.get(key)
+                if value is not None and (self.timeToLive is None \
+                        or loadTime is None \
+                        or now - loadTime <= self.timeToLive):
+                    values[args] = value
+                    if self._HasLimits():
+                        for row in value if not isSingleRowPath else [value]:
+                            self._AddRowToLru(row)
+                elif path.misses and path._IsMissCached(args):
+                    values[args] = None
+                else:
+                    missingArgs.append(args)
+        if missingArgs:
+            if self.tracePathLoads:
+                cx_Logging.Debug("%s: loading %d keys by path %s", self.name,
+                        len(missingArgs), pathName)
+            if path._CanLoadForKeys():
+                self._LoadMissingKeys(cache, path, missingArgs, values)
+            else:
+                for args in missingArgs:
+                    try:
+                        values[args] = self.Load(cache, pathName, *args)
+                    except cx_Exceptions.NoDataFound:
+                        values[args] = None
+        return [values[a] for a in argsList]
 
     def OnLoadRows(self, cache, rows):
+        """Called once the rows have been loaded and placed in the path
+           that loaded them. The on load row method is called without holding
+           the sub cache lock since it may look up values in other caches."""
+        with self.lock:
+            method = getattr(self, self.addRowMethodName, None)
+            if method is not None:
+                for row in rows:
+                    method(row)
+            if self._IsTimed():
+                self._SetLoadTimes(rows)
+            for path in self.missPaths:
+                for row in rows:
+                    path.ClearMiss(row)
+            if self._HasLimits():
+                for row in rows:
+                    self._AddRowToLru(row)
+                self._EvictRows(set(rows))
         method = getattr(self, self.onLoadRowMethodName, None)
         if method is not None:
             for row in rows:
                 method(cache, row)
 
+    def RefreshAhead(self, cache, pathName, *args):
+        """Reload the value for the path in a background thread while the
+           cached value continues to be served; the new value replaces the
+           cached value once it has been loaded. Only one refresh is performed
+           at a time for each path and set of arguments and nothing is done if
+           the data source is not thread safe."""
+        if not cache.dataSource.threadSafe:
+            return
+        refreshKey = (pathName, args)
+        with self.refreshLock:
+            if refreshKey in self.pendingRefreshes:
+                return
+            self.pendingRefreshes.add(refreshKey)
+        if self.tracePathLoads:
+            cx_Logging.Debug("%s: refreshing rows by path %s with args %s",
+                    self.name, pathName, args)
+        thread = cx_Threads.Thread(self._Refresh, cache, pathName, args)
+        thread.start()
+
+    def Reload(self, cache, pathName, *args):
+        """Discard the cached value for the path (which has expired) and the
+           rows it contains and load it again."""
+        if self.loadAllRowsOnFirstLoad:
+            self.Clear()
+            return self.Load(cache, pathName, *args)
+        path = self.pathsByName[pathName]
+        key = args[0] if len(args) == 1 else args
+        with self.lock:
+            value = path.rows.get(key)
+            if isinstance(value, list):
+                for row in list(value):
+                    self._EvictRow(row)
+            elif value is not None:
+                self._EvictRow(value)
+            path.rows.pop(key, None)
+            path.loadTimes.pop(key, None)
+        return self.Load(cache, pathName, *args)
+
     def RemoveRow(self, cache, externalRow):
-        row = self._FindRow(externalRow, errorIfMissing = True)
-        cx_Logging.Debug("%s: removing row %s", self.name, row)
-        self.OnRemoveRow(cache, row)
-        if self.allRowsLoaded:
-            self.allRows.remove(row)
+        with self.lock:
+            row = self._FindRow(externalRow, errorIfMissing = True)
+            cx_Logging.Debug("%s: removing row %s", self.name, row)
+            self.OnRemoveRow(cache, row)
+            if self.allRowsLoaded and row in self.allRows:
+                self.allRows.remove(row)
+            self._RemoveRowFromLru(row)
 
     def UpdateRow(self, cache, externalRow, contextItem = None):
-        row = self._FindRow(externalRow)
-        if row is None:
-            cx_Logging.Debug("%s: creating new row with source as %s",
-                    self.name, externalRow)
-            row = self.rowClass.New()
-            self._CopyAttrs(row, externalRow, contextItem)
-            self.OnLoadRow(cache, row)
-            if not self.loadAllRowsOnFirstLoad:
-                for path in self.paths:
-                    if isinstance(path, MultipleRowPath):
-                        key = path.GetKeyValue(row)
-                        path.rows.setdefault(key, []).append(row)
-            if self.allRowsLoaded:
-                self.allRows.append(row)
+        with self.lock:
+            row = self._FindRow(externalRow)
+            isNewRow = row is None
+            if isNewRow:
+                cx_Logging.Debug("%s: creating new row with source as %s",
+                        self.name, externalRow)
+                row = self.rowClass.New()
+                self._CopyAttrs(row, externalRow, contextItem)
+                method = getattr(self, self.addRowMethodName, None)
+                if method is not None:
+                    method(row)
+                if not self.loadAllRowsOnFirstLoad:
+                    for path in self.paths:
+                        if isinstance(path, MultipleRowPath):
+                            key = path.GetKeyValue(row)
+                            path.rows.setdefault(key, []).append(row)
+                if self.allRowsLoaded:
+                    self.allRows.append(row)
+                if self._IsTimed():
+                    self._SetLoadTimes([row])
+                for path in self.missPaths:
+                    path.ClearMiss(row)
+                if self._HasLimits():
+                    self._AddRowToLru(row)
+                    self._EvictRows()
+            else:
+                cx_Logging.Debug("%s: modifying row %s", self.name, row)
+                beforeKeyValues = []
+                for path in self.singleRowPaths:
+                    beforeKeyValues.append((path, path.GetKeyValue(row)))
+                self._CopyAttrs(row, externalRow, contextItem)
+                for path, beforeKeyValue in beforeKeyValues:
+                    afterKeyValue = path.GetKeyValue(row)
+                    if afterKeyValue != beforeKeyValue:
+                        del path.rows[beforeKeyValue]
+                        path.rows[afterKeyValue] = row
+                        loadTime = path.loadTimes.pop(beforeKeyValue, None)
+                        if loadTime is not None:
+                            path.loadTimes[afterKeyValue] = loadTime
+                        path.ClearMiss(row)
+        if isNewRow:
+            method = getattr(self, self.onLoadRowMethodName, None)
+            if method is not None:
+                method(cache, row)
         else:
-            cx_Logging.Debug("%s: modifying row %s", self.name, row)
-            beforeKeyValues = []
-            for path in self.singleRowPaths:
-                beforeKeyValues.append((path, path.GetKeyValue(row)))
-            self._CopyAttrs(row, externalRow, contextItem)
-            for path, beforeKeyValue in beforeKeyValues:
-                afterKeyValue = path.GetKeyValue(row)
-                if afterKeyValue != beforeKeyValue:
-                    del path.rows[beforeKeyValue]
-                    path.rows[afterKeyValue] = row
             method = getattr(self, self.setExtraAttrValuesMethodName, None)
             if method is not None:
                 method(cache, row)
@@ -345,22 +934,24 @@ class SubCache(object, metaclass = SubCacheMetaClass):
 class XrefSubCache(SubCache):
 
     def AddRow(self, cache, key1, key2):
-        cx_Logging.Debug("%s: adding xref between %s and %s", self.name, key1,
-                key2)
-        path1, path2 = self.paths
-        if key1 in path1.rows:
-            path1.rows[key1].append(key2)
-        if key2 in path2.rows:
-            path2.rows[key2].append(key1)
+        with self.lock:
+            cx_Logging.Debug("%s: adding xref between %s and %s", self.name,
+                    key1, key2)
+            path1, path2 = self.paths
+            if key1 in path1.rows:
+                path1.rows[key1].append(key2)
+            if key2 in path2.rows:
+                path2.rows[key2].append(key1)
 
     def RemoveRow(self, cache, key1, key2):
-        cx_Logging.Debug("%s: removing xref between %s and %s", self.name,
-                key1, key2)
-        path1, path2 = self.paths
-        if key1 in path1.rows:
-            path1.rows[key1].remove(key2)
-        if key2 in path2.rows:
-            path2.rows[key2].remove(key1)
+        with self.lock:
+            cx_Logging.Debug("%s: removing xref between %s and %s", self.name,
+                    key1, key2)
+            path1, path2 = self.paths
+            if key1 in path1.rows:
+                path1.rows[key1].remove(key2)
+            if key2 in path2.rows:
+                path2.rows[key2].remove(key1)
 
 
 class CacheMetaClass(type):
@@ -376,12 +967,15 @@ class CacheMetaClass(type):
 
 class Cache(object, metaclass = CacheMetaClass):
     subCacheClasses = {}
+    threadSafe = False
 
     def __init__(self, dataSource):
         self.dataSource = dataSource
         self.subCaches = []
         for cls in self.subCacheClasses.values():
             subCache = cls(self)
+            if self.threadSafe:
+                subCache.threadSafe = True
             self.subCaches.append(subCache)
             if cls.cacheAttrName is not None:
                 setattr(self, cls.cacheAttrName, subCache)
@@ -390,3 +984,6 @@ class Cache(object, metaclass = CacheMetaClass):
         for subCache in self.subCaches:
             subCache.Clear()
 
+
+class LoadInterrupted(cx_Exceptions.BaseException):
+    message = "The load of the value in another thread was interrupted."
@@ -0,0 +1,245 @@
+"""
+Define relational operators (join, group by and distinct) which operate in
+memory on the rows of data sets (or any sequence of rows), allowing data
+retrieved from different data sources to be combined without another round
+trip to a database. The results are rows of classes generated by the row
+metaclass, in the same way as the row classes of data sets are generated.
+Vectorized aggregates over the NumPy arrays returned by DataSet.ToArrays()
+and Row.GetArrays() are also defined, if NumPy is available.
+"""
+
+import ceDatabase
+import decimal
+import operator
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+AGGREGATE_FUNCTIONS = ("avg", "count", "max", "min", "sum")
+
+_rowClasses = {}
+
+def _GetRowClass(name, attrNames, sourceClasses, pkAttrNames = [],
+        decimalAttrNames = []):
+    """Return a row class with the given attributes, generated by the row
+       metaclass; the decimal attributes of the source row classes are
+       retained (the conversion performed for them returns values that are
+       already decimals unchanged) and the classes are cached so that the
+       constructors are only generated once."""
+    for cls in sourceClasses:
+        if cls is not None:
+            decimalAttrNames = decimalAttrNames + \
+                    [n for n in cls.decimalAttrNames \
+                            if n in attrNames and n not in decimalAttrNames]
+    key = (name, tuple(attrNames), tuple(pkAttrNames),
+            tuple(decimalAttrNames))
+    cls = _rowClasses.get(key)
+    if cls is None:
+        classDict = dict(attrNames = list(attrNames),
+                pkAttrNames = list(pkAttrNames),
+                decimalAttrNames = decimalAttrNames)
+        cls = _rowClasses[key] = \
+                ceDatabase.RowMetaClass(name, (ceDatabase.Row,), classDict)
+    return cls
+
+
+def _GetSource(source):
+    """Return the rows and the row class of the source, which is either a
+       data set or a sequence of rows."""
+    if isinstance(source, ceDatabase.DataSet):
+        return source.GetRows(), source.rowClass
+    rows = list(source)
+    rowClass = rows[0].__class__ if rows else None
+    return rows, rowClass
+
+
+def _GetValuesFunction(attrNames):
+    """Return a function which returns a tuple of the values of the given
+       attributes for a row."""
+    if len(attrNames) == 1:
+        getter = operator.attrgetter(attrNames[0])
+        return lambda row: (getter(row),)
+    return operator.attrgetter(*attrNames)
+
+
+def _GetUnmaskedValues(values):
+    """Return an array of the values which are not masked."""
+    if numpy is None:
+        raise ceDatabase.NumPyNotAvailable()
+    if isinstance(values, numpy.ma.MaskedArray):
+        return values.compressed()
+    return numpy.asarray(values)
+
+
+def _NormalizeNames(attrNames):
+    if isinstance(attrNames, str):
+        return attrNames.split()
+    return list(attrNames)
+
+
+def Distinct(source, attrNames = None, name = "DistinctRow"):
+    """Return the distinct rows of the source, in the order in which they
+       first occur. If attribute names are specified, the rows returned are
+       of a new row class with only those attributes; otherwise, the first
+       occurrence of each distinct row in the source is returned."""
+    rows, rowClass = _GetSource(source)
+    if attrNames is None:
+        if rowClass is None:
+            return []
+        getValues = _GetValuesFunction(rowClass.attrNames)
+        rowsByKey = {}
+        for row in rows:
+            rowsByKey.setdefault(getValues(row), row)
+        return list(rowsByKey.values())
+    attrNames = _NormalizeNames(attrNames)
+    getValues = _GetValuesFunction(attrNames)
+    resultClass = _GetRowClass(name, attrNames, [rowClass],
+            pkAttrNames = attrNames)
+    return resultClass.FromTuples(list(dict.fromkeys(map(getValues, rows))))
+
+
+def Histogram(values, bins = 10, range = None):
+    """Return a tuple of the counts and the bin edges of a histogram of the
+       array of values, ignoring masked (null) values; see numpy.histogram()
+       for the meaning of the bins and range arguments."""
+    return numpy.histogram(_GetUnmaskedValues(values), bins, range)
+
+
+def GroupBy(source, groupAttrNames, aggregates, name = "GroupRow"):
+    """Group the rows of the source by the values of the given attributes and
+       return a row for each group (in the order in which the groups first
+       occur) with the group attributes and the requested aggregates. The
+       aggregates are specified as a dictionary mapping the name of the result
+       attribute to a tuple of the form (function, attrName) where the
+       function is one of avg, count, max, min or sum; an attribute name of
+       None may be used with count in order to count the rows in each group.
+       As in SQL, null values are ignored and the aggregate of a group without
+       any values is None (0 for count). Averages of decimal attributes are
+       computed as decimals."""
+    rows, rowClass = _GetSource(source)
+    groupAttrNames = _NormalizeNames(groupAttrNames)
+    sourceDecimalAttrNames = rowClass.decimalAttrNames \
+            if rowClass is not None else []
+    resultAttrNames = list(groupAttrNames)
+    resultDecimalAttrNames = []
+    aggregateInfo = []
+    for resultAttrName, (function, attrName) in aggregates.items():
+        if function not in AGGREGATE_FUNCTIONS:
+            raise ValueError("invalid aggregate function %r" % function)
+        if attrName is None and function != "count":
+            raise ValueError("aggregate function %r requires an attribute" % \
+                    function)
+        isDecimal = attrName in sourceDecimalAttrNames
+        if isDecimal and function != "count":
+            resultDecimalAttrNames.append(resultAttrName)
+        getter = operator.attrgetter(attrName) \
+                if attrName is not None else None
+        aggregateInfo.append((function, getter, isDecimal))
+        resultAttrNames.append(resultAttrName)
+    getKey = _GetValuesFunction(groupAttrNames)
+    groups = {}
+    for row in rows:
+        key = getKey(row)
+        groupRows = groups.get(key)
+        if groupRows is None:
+            groupRows = groups[key] = []
+        groupRows.append(row)
+    resultTuples = []
+    for key, groupRows in groups.items():
+        values = list(key)
+        for function, getter, isDecimal in aggregateInfo:
+            if getter is None:
+                values.append(len(groupRows))
+                continue
+            attrValues = [v for v in map(getter, groupRows) if v is not None]
+            if function == "count":
+                value = len(attrValues)
+            elif not attrValues:
+                value = None
+            elif function == "sum":
+                value = sum(attrValues)
+            elif function == "min":
+                value = min(attrValues)
+            elif function == "max":
+                value = max(attrValues)
+            elif isDecimal:
+                value = sum(attrValues) / decimal.Decimal(len(attrValues))
+            else:
+                value = sum(attrValues) / len(attrValues)
+            values.append(value)
+        resultTuples.append(values)
+    resultClass = _GetRowClass(name, resultAttrNames, [rowClass],
+            pkAttrNames = groupAttrNames,
+            decimalAttrNames = resultDecimalAttrNames)
+    return resultClass.FromTuples(resultTuples)
+
+
+def HashJoin(left, right, leftAttrNames, rightAttrNames = None,
+        outer = False, name = "JoinedRow"):
+    """Join the rows of the left source to the rows of the right source where
+       the values of the left attributes are equal to the values of the right
+       attributes (the same attributes are used on both sides if the right
+       attributes are not specified) and return the joined rows in the order
+       of the left source. A hash table is built on the right source, which
+       should therefore be the smaller one. The joined rows have all of the
+       attributes of the left rows followed by the attributes of the right
+       rows that are not also attributes of the left rows. As in SQL, rows
+       with null values in any of the join attributes do not match; if outer
+       is true, left rows without a match are included with None for the
+       attributes of the right rows."""
+    leftRows, leftClass = _GetSource(left)
+    rightRows, rightClass = _GetSource(right)
+    leftAttrNames = _NormalizeNames(leftAttrNames)
+    rightAttrNames = leftAttrNames if rightAttrNames is None \
+            else _NormalizeNames(rightAttrNames)
+    if len(leftAttrNames) != len(rightAttrNames):
+        raise ValueError("left and right join attributes do not match")
+    leftNames = leftClass.attrNames if leftClass is not None else []
+    rightNames = [n for n in rightClass.attrNames if n not in leftNames] \
+            if rightClass is not None else []
+    getLeftValues = _GetValuesFunction(leftNames) if leftNames else None
+    getRightValues = _GetValuesFunction(rightNames) if rightNames else None
+    getLeftKey = _GetValuesFunction(leftAttrNames)
+    getRightKey = _GetValuesFunction(rightAttrNames)
+    rightValuesByKey = {}
+    for row in rightRows:
+        key = getRightKey(row)
+        if None in key:
+            continue
+        values = getRightValues(row) if getRightValues is not None else ()
+        rightValuesByKey.setdefault(key, []).append(values)
+    outerValues = [(None,) * len(rightNames)]
+    resultTuples = []
+    for row in leftRows:
+        key = getLeftKey(row)
+        matches = rightValuesByKey.get(key) if None not in key else None
+        if matches is None:
+            if not outer:
+                continue
+            matches = outerValues
+        leftValues = getLeftValues(row) if getLeftValues is not None else ()
+        for rightValues in matches:
+            resultTuples.append(leftValues + rightValues)
+    resultClass = _GetRowClass(name, leftNames + rightNames,
+            [leftClass, rightClass])
+    return resultClass.FromTuples(resultTuples)
+
+
+def Mean(values):
+    """Return the mean of the array of values, ignoring masked (null) values,
+       or None if there are no values which are not masked."""
+    values = _GetUnmaskedValues(values)
+    if len(values) == 0:
+        return None
+    return values.mean()
+
+
+def Sum(values):
+    """Return the sum of the array of values, ignoring masked (null) values,
+       or None if there are no values which are not masked."""
+    values = _GetUnmaskedValues(values)
+    if len(values) == 0:
+        return None
+    return values.sum()
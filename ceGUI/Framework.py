@@ -58,6 +58,11 @@ class DataSet(ceDatabase.DataSet):
         app = wx.GetApp()
         return app.config
 
+    def _CanPrefetch(self):
+        if self.selectCacheAttrName is not None or self.rowClass.cached:
+            return False
+        return super(DataSet, self)._CanPrefetch()
+
     def _GetRows(self, *args):
         if self.selectCacheAttrName is not None:
             method = getattr(self.cache, self.selectCacheAttrName)
@@ -71,6 +76,11 @@ class DataSet(ceDatabase.DataSet):
                 return [row]
         return super(DataSet, self)._GetRows(*args)
 
+    def _IterRows(self, *args):
+        if self.selectCacheAttrName is not None or self.rowClass.cached:
+            return iter(self._GetRows(*args))
+        return super(DataSet, self)._IterRows(*args)
+
     def Update(self):
         if self.updateSubCacheAttrName is not None or self.rowClass.cached:
             rowsToUpdate = [self.rows[h] for h in self.insertedRows] + \
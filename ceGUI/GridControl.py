@@ -34,6 +34,7 @@ class Grid(ceGUI.BaseControl, wx.grid.Grid):
     hideRowLabels = True
     enablePaste = True
     enableCopy = True
+    projectColumns = False
 
     def __init__(self, parent):
         wx.grid.Grid.__init__(self, parent)
@@ -421,6 +422,8 @@ class Grid(ceGUI.BaseControl, wx.grid.Grid):
             self._Resize()
 
     def Retrieve(self, *args):
+        if self.projectColumns:
+            self.SetProjectionFromColumns()
         self.Clear()
         self.table.Retrieve(*args)
         self.OnRetrieve()
@@ -433,6 +436,10 @@ class Grid(ceGUI.BaseControl, wx.grid.Grid):
             widths = [self.GetColSize(i) for i in range(numColumns - 1)]
             self.WriteSetting(settingsName, tuple(widths))
 
+    def SetProjectionFromColumns(self):
+        attrNames = [c.attrName for c in self.columns]
+        self.dataSet.SetProjection(*attrNames)
+
     def SortItems(self, columnIndex = None):
         col = self.GetGridCursorCol()
         row = self.table.SortItems(columnIndex, self.GetGridCursorRow())
@@ -25,6 +25,7 @@ class List(ceGUI.BaseControl, wx.ListCtrl):
     sortByAttrNames = None
     sortOnRetrieve = True
     enableColumnSorting = True
+    projectColumns = False
 
     def __init__(self, parent, style = 0):
         if self.singleSelection:
@@ -226,6 +227,40 @@ class List(ceGUI.BaseControl, wx.ListCtrl):
         if self.sortOnRetrieve:
             self.SortItems()
 
+    def RefreshChanges(self):
+        """Merge the rows changed in the database since the last retrieval
+           into the list (see DataSet.Refresh()), retaining the position,
+           selection and focus of the rows which remain. If the data set has
+           to be retrieved again instead, the list is rebuilt as it is when it
+           is retrieved."""
+        if not self.dataSet.CanRefreshIncrementally():
+            self.DeleteAllItems()
+            self.dataSet.Refresh()
+            self.RefreshFromDataSet()
+            return
+        focusedState = self._SaveItemState(wx.LIST_STATE_FOCUSED)
+        selectedState = self._SaveItemState(wx.LIST_STATE_SELECTED)
+        addedHandles, changedHandles, removedHandles = self.dataSet.Refresh()
+        if removedHandles:
+            removedHandles = set(removedHandles)
+            self.rowHandles = [h for h in self.rowHandles \
+                    if h not in removedHandles]
+            focusedState = [h for h in focusedState \
+                    if h not in removedHandles]
+            selectedState = [h for h in selectedState \
+                    if h not in removedHandles]
+        self.rowHandles.extend(addedHandles)
+        self.SetItemCount(len(self.rowHandles))
+        itemIndexDict = dict([(h, i) for i, h in enumerate(self.rowHandles)])
+        self._RestoreItemState(itemIndexDict, focusedState,
+                wx.LIST_STATE_FOCUSED)
+        self._RestoreItemState(itemIndexDict, selectedState,
+                wx.LIST_STATE_SELECTED)
+        if self.sortOnRetrieve and (addedHandles or changedHandles):
+            self.SortItems()
+        else:
+            self.Refresh()
+
     def RestoreColumnWidths(self, settingsName = None):
         if settingsName is None:
             settingsName = self.settingsName
@@ -235,6 +270,8 @@ class List(ceGUI.BaseControl, wx.ListCtrl):
                 self.SetColumnWidth(columnIndex, width)
 
     def Retrieve(self, *args):
+        if self.projectColumns:
+            self.SetProjectionFromColumns()
         with ceGUI.BusyCursorContext(parent = self.GetParent()):
             self.DeleteAllItems()
             self.dataSet.Retrieve(*args)
@@ -289,6 +326,10 @@ class List(ceGUI.BaseControl, wx.ListCtrl):
         if refresh:
             self.Refresh()
 
+    def SetProjectionFromColumns(self):
+        attrNames = [c.attrName for c in self.columns] + self.sortByAttrNames
+        self.dataSet.SetProjection(*attrNames)
+
     def SetSingleSelection(self, singleSelection = True):
         self.SetSingleStyle(wx.LC_SINGLE_SEL, add = singleSelection)
 
@@ -3,6 +3,7 @@
 import cx_Exceptions
 import cx_Logging
 import threading
+import time
 
 class Thread(threading.Thread):
     """Base class for threads which extends the threading module to include
@@ -85,61 +86,192 @@ class Queue(object):
 
 
 class ResourcePool(object):
-    """Implements a pool of resources."""
+    """Implements a pool of resources. Optionally resources which were
+       created more than maxLifetime seconds ago are discarded, resources
+       which have been idle for longer than idleTimeout seconds are discarded
+       as long as minResources remain and resources are validated by calling
+       validateResourceFunc before they are handed out. Resources that are
+       discarded are passed to destroyResourceFunc, if specified."""
 
-    def __init__(self, maxResources, newResourceFunc):
+    def __init__(self, maxResources, newResourceFunc, minResources = 0,
+            idleTimeout = None, maxLifetime = None,
+            validateResourceFunc = None, destroyResourceFunc = None):
         self.lock = threading.Lock()
-        self.poolEvent = threading.Event()
+        self.poolCondition = threading.Condition(self.lock)
         self.freeResources = []
         self.busyResources = []
         self.maxResources = maxResources
         self.newResourceFunc = newResourceFunc
+        self.minResources = minResources
+        self.idleTimeout = idleTimeout
+        self.maxLifetime = maxLifetime
+        self.validateResourceFunc = validateResourceFunc
+        self.destroyResourceFunc = destroyResourceFunc
+        self.resourceTimes = {}
+        self.numPending = 0
+        self.numCreated = 0
+        self.numDestroyed = 0
+        self.numGets = 0
+        self.numWaits = 0
+        self.totalWaitTime = 0.0
+        self.maxWaitTime = 0.0
+        for i in range(minResources):
+            self.freeResources.append(self._CreateResource())
+
+    def _CreateResource(self):
+        resource = self.newResourceFunc()
+        now = time.time()
+        self.lock.acquire()
+        self.resourceTimes[id(resource)] = [now, now]
+        self.numCreated += 1
+        self.lock.release()
+        return resource
+
+    def _DestroyResource(self, resource):
+        self.lock.acquire()
+        self.resourceTimes.pop(id(resource), None)
+        self.numDestroyed += 1
+        self.lock.release()
+        if self.destroyResourceFunc is not None:
+            try:
+                self.destroyResourceFunc(resource)
+            except:
+                cx_Logging.LogException()
+
+    def _IsExpired(self, resource, now, checkIdleTimeout = True):
+        createTime, lastUsedTime = self.resourceTimes[id(resource)]
+        if self.maxLifetime is not None \
+                and now - createTime > self.maxLifetime:
+            return True
+        if checkIdleTimeout and self.idleTimeout is not None \
+                and now - lastUsedTime > self.idleTimeout:
+            return True
+        return False
+
+    def _IsValid(self, resource):
+        self.lock.acquire()
+        try:
+            if self._IsExpired(resource, time.time(),
+                    checkIdleTimeout = False):
+                return False
+        finally:
+            self.lock.release()
+        if self.validateResourceFunc is not None:
+            try:
+                return self.validateResourceFunc(resource)
+            except:
+                cx_Logging.LogException()
+                return False
+        return True
 
     def Destroy(self):
         """Destroy the resource pool, this blocks until all resources are
            returned to the pool for destruction."""
         self.lock.acquire()
+        resources = self.freeResources
         self.freeResources = []
         self.maxResources = 0
         self.lock.release()
-        while self.busyResources:
-            self.poolEvent.wait()
+        for resource in resources:
+            self._DestroyResource(resource)
+        self.lock.acquire()
+        try:
+            while self.busyResources:
+                self.poolCondition.wait()
+        finally:
+            self.lock.release()
 
     def Get(self):
         """Gets a resource form the pool, creating new resources as necessary.
            The calling thread will block until a resource is available, if
            necessary."""
+        startTime = time.time()
+        waited = False
         resource = None
-        self.lock.acquire()
         while resource is None:
+            self.lock.acquire()
+            try:
+                while True:
+                    if self.freeResources:
+                        resource = self.freeResources.pop()
+                        break
+                    elif len(self.busyResources) + self.numPending \
+                            < self.maxResources:
+                        break
+                    elif not self.maxResources:
+                        raise Exception("No resources not available.")
+                    waited = True
+                    self.poolCondition.wait()
+                self.numPending += 1
+            finally:
+                self.lock.release()
             try:
-                if self.freeResources:
-                    resource = self.freeResources.pop()
-                elif len(self.busyResources) < self.maxResources:
-                    resource = self.newResourceFunc()
-                elif not self.maxResources:
-                    raise Exception("No resources not available.")
+                if resource is None:
+                    resource = self._CreateResource()
+                elif not self._IsValid(resource):
+                    self._DestroyResource(resource)
+                    resource = None
+            finally:
+                self.lock.acquire()
+                self.numPending -= 1
+                if resource is not None:
+                    self.busyResources.append(resource)
                 else:
-                    self.lock.release()
-                    self.poolEvent.wait()
-                    self.lock.acquire()
-            except:
-                if self.lock.locked():
-                    self.lock.release()
-                raise
-        self.busyResources.append(resource)
+                    self.poolCondition.notify_all()
+                self.lock.release()
+        waitTime = time.time() - startTime
+        self.lock.acquire()
+        self.numGets += 1
+        if waited:
+            self.numWaits += 1
+        self.totalWaitTime += waitTime
+        self.maxWaitTime = max(self.maxWaitTime, waitTime)
         self.lock.release()
         return resource
 
+    def GetStats(self):
+        """Return a dictionary containing statistics about the pool,
+           including the time spent waiting for resources."""
+        self.lock.acquire()
+        try:
+            numGets = self.numGets
+            return dict(busy = len(self.busyResources),
+                    free = len(self.freeResources),
+                    created = self.numCreated, destroyed = self.numDestroyed,
+                    gets = numGets, waits = self.numWaits,
+                    totalWaitTime = self.totalWaitTime,
+                    averageWaitTime = self.totalWaitTime / numGets \
+                            if numGets else 0.0,
+                    maxWaitTime = self.maxWaitTime)
+        finally:
+            self.lock.release()
+
     def Put(self, resource, addToFreeList = True):
         """Put a resource back into the pool."""
+        resourcesToDestroy = []
         self.lock.acquire()
         try:
             index = self.busyResources.index(resource)
             del self.busyResources[index]
-            if self.maxResources and addToFreeList:
+            now = time.time()
+            times = self.resourceTimes.get(id(resource))
+            if times is not None:
+                times[1] = now
+            if self.maxResources and addToFreeList \
+                    and not self._IsExpired(resource, now,
+                            checkIdleTimeout = False):
                 self.freeResources.append(resource)
+            else:
+                resourcesToDestroy.append(resource)
+            numToRemove = len(self.freeResources) + \
+                    len(self.busyResources) - self.minResources
+            while numToRemove > 0 and self.freeResources \
+                    and self._IsExpired(self.freeResources[0], now):
+                resourcesToDestroy.append(self.freeResources.pop(0))
+                numToRemove -= 1
+            self.poolCondition.notify_all()
         finally:
             self.lock.release()
-        self.poolEvent.set()
+        for resource in resourcesToDestroy:
+            self._DestroyResource(resource)
 
@@ -0,0 +1,107 @@
+"""
+Common classes used by the tests, which use an in memory SQLite database
+accessed through an ODBC style data source.
+"""
+
+import ceDatabase
+import ceDataSource
+import decimal
+import sqlite3
+import unittest
+
+sqlite3.register_adapter(decimal.Decimal, str)
+
+SCHEMA = """
+        create table Parent (
+            id integer primary key,
+            name text,
+            flag text,
+            amount text
+        );
+        create table Child (
+            id integer primary key,
+            parentId integer,
+            description text
+        );
+        insert into Parent values (1, 'One', 'Y', '1.5');
+        insert into Parent values (2, 'Two', 'N', '2.5');
+        insert into Parent values (3, 'Three', 'Y', null);
+        insert into Parent values (4, 'Four', 'Y', '4');
+        insert into Child values (1, 1, 'a');
+        insert into Child values (2, 1, 'b');
+        insert into Child values (3, 2, 'c');
+        insert into Child values (4, 4, 'd');"""
+
+
+class Cursor(sqlite3.Cursor):
+    """Cursor which supports the row factories and input sizes of the
+       drivers used with the data sources."""
+    rowfactory = None
+
+    def _ApplyRowFactory(self, rows):
+        if self.rowfactory is None:
+            return rows
+        return [self.rowfactory(*r) for r in rows]
+
+    def execute(self, sql, args = ()):
+        self.connection.statements.append(sql)
+        return super(Cursor, self).execute(sql, args)
+
+    def executemany(self, sql, argsList):
+        self.connection.statements.append(sql)
+        return super(Cursor, self).executemany(sql, argsList)
+
+    def fetchall(self):
+        return self._ApplyRowFactory(super(Cursor, self).fetchall())
+
+    def fetchmany(self, size = None):
+        if size is None:
+            size = self.arraysize
+        return self._ApplyRowFactory(super(Cursor, self).fetchmany(size))
+
+    def setinputsizes(self, *args, **keywordArgs):
+        pass
+
+
+class Connection(sqlite3.Connection):
+    """Connection which returns cursors of the above class and records the
+       statements that are executed."""
+
+    def __init__(self, *args, **keywordArgs):
+        super(Connection, self).__init__(*args, **keywordArgs)
+        self.statements = []
+
+    def cursor(self):
+        return super(Connection, self).cursor(Cursor)
+
+
+class ParentDataSet(ceDatabase.DataSet):
+    tableName = "Parent"
+    attrNames = "id name flag amount"
+    charBooleanAttrNames = "flag"
+    decimalAttrNames = "amount"
+    pkAttrNames = "id"
+    sortByAttrNames = "name"
+
+
+class ChildDataSet(ceDatabase.DataSet):
+    tableName = "Child"
+    attrNames = "id parentId description"
+    pkAttrNames = "id"
+    retrievalAttrNames = "parentId"
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = sqlite3.connect(":memory:", factory = Connection,
+                check_same_thread = False)
+        self.connection.executescript(SCHEMA)
+        self.dataSource = ceDataSource.ODBCDataSource(self.connection)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def Execute(self, sql, *args):
+        self.connection.execute(sql, args)
+        self.connection.commit()
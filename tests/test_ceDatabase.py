@@ -0,0 +1,39 @@
+"""
+Tests for the data sets and indexes defined in ceDatabase.
+"""
+
+import ceDatabase
+import common
+import unittest
+
+class FilteredParentDataSet(ceDatabase.FilteredDataSet):
+    rowClass = common.ParentDataSet.rowClass
+
+
+class TestFilteredDataSet(common.TestCase):
+
+    def _CheckFilterAfterRetrieve(self, addIndexFirst):
+        dataSet = common.ParentDataSet(self.dataSource)
+        if addIndexFirst:
+            dataSet.AddHashIndex("flag")
+        filteredDataSet = FilteredParentDataSet(dataSet)
+        filteredDataSet.SetFilter(flag = True)
+        if not addIndexFirst:
+            dataSet.AddHashIndex("flag")
+        dataSet.Retrieve()
+        ids = sorted(r.id for r in filteredDataSet.GetRows())
+        self.assertEqual(ids, [1, 3, 4])
+        dataSet.SetRows(dataSet.GetRows()[:2])
+        ids = sorted(r.id for r in filteredDataSet.GetRows())
+        self.assertEqual(ids,
+                sorted(r.id for r in dataSet.GetRows() if r.flag))
+
+    def testFilterAfterRetrieveIndexAddedFirst(self):
+        self._CheckFilterAfterRetrieve(addIndexFirst = True)
+
+    def testFilterAfterRetrieveIndexAddedLast(self):
+        self._CheckFilterAfterRetrieve(addIndexFirst = False)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,222 @@
+"""
+Tests for the caches defined in ceDatabaseCache.
+"""
+
+import ceDatabase
+import ceDatabaseCache
+import collections
+import common
+import cx_Exceptions
+import threading
+import time
+import unittest
+
+ExternalChild = collections.namedtuple("ExternalChild",
+        "id parentId description")
+
+class ChildSubCache(ceDatabaseCache.SubCache):
+    rowClass = common.ChildDataSet.rowClass
+    cacheAttrName = "children"
+
+    class ById(ceDatabaseCache.SingleRowPath):
+        retrievalAttrNames = "id"
+        cacheAttrName = "ChildById"
+
+    class ByParent(ceDatabaseCache.MultipleRowPath):
+        retrievalAttrNames = "parentId"
+        cacheAttrName = "ChildrenByParent"
+
+
+class LimitedCache(ceDatabaseCache.Cache):
+
+    class Children(ChildSubCache):
+        maxRows = 3
+
+
+class TestLruEviction(common.TestCase):
+
+    def setUp(self):
+        super(TestLruEviction, self).setUp()
+        self.cache = LimitedCache(self.dataSource)
+        self.subCache = self.cache.children
+
+    def testLeastRecentlyUsedRowsAreEvicted(self):
+        for childId in (1, 2, 3):
+            self.cache.ChildById(childId)
+        self.cache.ChildById(1)
+        self.cache.ChildById(4)
+        self.assertEqual(sorted(self.subCache.rowsByById), [1, 3, 4])
+        self.assertEqual(len(self.subCache.lruRows), 3)
+
+    def testEvictedGroupIsNotServedPartially(self):
+        self.assertEqual(len(self.cache.ChildrenByParent(1)), 2)
+        self.cache.ChildById(3)
+        self.cache.ChildById(4)
+        self.assertNotIn(1, self.subCache.rowsByByParent)
+        self.assertEqual(len(self.cache.ChildrenByParent(1)), 2)
+
+    def testRemoveRowAfterSiblingEvicted(self):
+        self.cache.ChildrenByParent(1)
+        self.cache.ChildById(3)
+        self.cache.ChildById(4)
+        self.assertNotIn(1, self.subCache.rowsByByParent)
+        remainingId, = [i for i in (1, 2) if i in self.subCache.rowsByById]
+        self.subCache.RemoveRow(self.cache,
+                ExternalChild(remainingId, 1, None))
+        self.assertNotIn(remainingId, self.subCache.rowsByById)
+
+    def testLargeGroupIsNotEvictedWhenLoaded(self):
+        for childId in range(5, 10):
+            self.Execute("insert into Child values (?, 5, 'x')", childId)
+        rows = self.cache.ChildrenByParent(5)
+        self.assertEqual(len(rows), 5)
+        self.assertIs(self.subCache.rowsByByParent[5], rows)
+        numStatements = len(self.connection.statements)
+        self.assertEqual(len(self.cache.ChildrenByParent(5)), 5)
+        self.assertEqual(len(self.connection.statements), numStatements)
+
+    def testEmptyResultsAreCountedAgainstLimit(self):
+        for parentId in range(10, 20):
+            self.assertEqual(self.cache.ChildrenByParent(parentId), [])
+        self.assertEqual(len(self.subCache.lruRows), 3)
+        self.assertEqual(sorted(self.subCache.rowsByByParent),
+                [17, 18, 19])
+
+
+class Interrupted(BaseException):
+    pass
+
+
+class SlowRow(ceDatabase.Row):
+    attrNames = "id otherId"
+    extraAttrNames = "other"
+
+
+class OtherSlowRow(ceDatabase.Row):
+    attrNames = "id otherId"
+    extraAttrNames = "other"
+
+
+class SlowPath(ceDatabaseCache.SingleRowPath):
+    retrievalAttrNames = "id"
+
+    def GetRowsFromDataSource(self, cache, rowId):
+        cache.queries.append((self.subCacheName, rowId))
+        time.sleep(0.2)
+        if rowId < 0:
+            raise cache.errorClass()
+        elif rowId == 0:
+            return []
+        otherId = cache.otherIds.get((self.subCacheName, rowId), 1)
+        return [self.rowClass(rowId, otherId)]
+
+
+class ThreadSafeCache(ceDatabaseCache.Cache):
+    threadSafe = True
+
+    def __init__(self, dataSource):
+        super(ThreadSafeCache, self).__init__(dataSource)
+        self.queries = []
+        self.otherIds = {}
+        self.errorClass = ValueError
+        self.onLoadRow = None
+
+    class Rows(ceDatabaseCache.SubCache):
+        rowClass = SlowRow
+        cacheAttrName = "rows"
+        onLoadRowExtraDirectives = "OtherRowById:otherId"
+
+        class ById(SlowPath):
+            cacheAttrName = "RowById"
+
+        def SetExtraAttrValues(self, cache, row):
+            if cache.onLoadRow is not None:
+                cache.onLoadRow(self, row)
+
+    class OtherRows(ceDatabaseCache.SubCache):
+        rowClass = OtherSlowRow
+        cacheAttrName = "otherRows"
+        onLoadRowExtraDirectives = "RowById:otherId"
+
+        class ById(SlowPath):
+            cacheAttrName = "OtherRowById"
+
+
+class TestThreadSafeLoading(common.TestCase):
+
+    def setUp(self):
+        super(TestThreadSafeLoading, self).setUp()
+        self.cache = ThreadSafeCache(self.dataSource)
+
+    def _RunInThreads(self, function, numThreads = 5):
+        results = [None] * numThreads
+        def Run(i):
+            try:
+                results[i] = function()
+            except BaseException as e:
+                results[i] = e
+        threads = [threading.Thread(target = Run, args = (i,)) \
+                for i in range(numThreads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        return results
+
+    def testConcurrentMissesQueryOnce(self):
+        results = self._RunInThreads(lambda: self.cache.RowById(2))
+        self.assertEqual(self.cache.queries.count(("Rows", 2)), 1)
+        self.assertTrue(all(r is results[0] for r in results))
+        self.assertIs(results[0].other, self.cache.OtherRowById(1))
+
+    def testWaitersReceiveTheirOwnErrors(self):
+        results = self._RunInThreads(lambda: self.cache.RowById(-1))
+        self.assertEqual(self.cache.queries, [("Rows", -1)])
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(len(set(map(id, results))), len(results))
+        results = self._RunInThreads(lambda: self.cache.RowById(0))
+        self.assertTrue(all(isinstance(r, cx_Exceptions.NoDataFound) \
+                for r in results))
+        self.assertFalse(self.cache.rows.pendingLoads)
+
+    def testWaitersAreReleasedWhenLoadIsInterrupted(self):
+        self.cache.errorClass = Interrupted
+        results = self._RunInThreads(lambda: self.cache.RowById(-1))
+        self.assertEqual(len(self.cache.queries), 1)
+        self.assertEqual(sum(isinstance(r, Interrupted) for r in results), 1)
+        self.assertEqual(sum(isinstance(r, ceDatabaseCache.LoadInterrupted) \
+                for r in results), len(results) - 1)
+        self.assertFalse(self.cache.rows.pendingLoads)
+
+    def testOnLoadRowRunsOutsideLock(self):
+        events = []
+        def OnLoadRow(subCache, row):
+            if row.id != 2:
+                return
+            events.append(subCache.rowsByById.get(row.id) is row)
+            def AcquireLock():
+                with subCache.lock:
+                    pass
+            thread = threading.Thread(target = AcquireLock)
+            thread.start()
+            thread.join(5)
+            events.append(thread.is_alive())
+        self.cache.onLoadRow = OnLoadRow
+        self.cache.RowById(2)
+        self.assertEqual(events, [True, False])
+
+    def testSubCachesReferringToEachOtherDoNotDeadlock(self):
+        self.cache.otherIds["OtherRows", 1] = 2
+        functions = [lambda: self.cache.RowById(1),
+                lambda: self.cache.OtherRowById(1)]
+        results = self._RunInThreads(lambda: functions.pop()(), 2)
+        row = self.cache.RowById(1)
+        otherRow = self.cache.OtherRowById(1)
+        self.assertIs(row.other, otherRow)
+        self.assertIs(otherRow.other, self.cache.RowById(2))
+        self.assertEqual(set(results), set([row, otherRow]))
+
+
+if __name__ == "__main__":
+    unittest.main()